@@ -25,7 +25,7 @@ class AttributeInline(generic.GenericTabularInline):
 	classes = COLLAPSE_CLASSES
 	form = AttributeForm
 	formset = AttributeInlineFormSet
-	fields = ['key', 'value_content_type']
+	fields = ['key', 'value_content_type', 'inline_value']
 	if 'grappelli' in settings.INSTALLED_APPS:
 		template = 'admin/philo/edit_inline/grappelli_tabular_attribute.html'
 	else:
@@ -14,6 +14,9 @@ class AttributeForm(ModelForm):
 	The fields defined will vary depending on the value type, but the fields for defining the value
 	(i.e. value_content_type and value_object_id) will always be defined. Except that value_object_id
 	will never be defined. BLARGH!
+	
+	The attribute's inline_value can be edited as well. Entering one replaces any related value;
+	choosing a value type clears it.
 	"""
 	def __init__(self, *args, **kwargs):
 		super(AttributeForm, self).__init__(*args, **kwargs)
@@ -32,10 +35,19 @@ class AttributeForm(ModelForm):
 	def save(self, *args, **kwargs):
 		# At this point, the cleaned_data has already been stored on self.instance.
 		
+		if 'inline_value' in self.changed_data and self.instance.inline_value is not None:
+			# A new inline value replaces the related value, if there was one.
+			self.instance.value_content_type = None
+		elif self.instance.value_content_type is not None:
+			# Otherwise, a related value makes any inline value stale.
+			self.instance.inline_value = None
+		
+		stale_value = None
 		if self.instance.value_content_type != self._cached_value_ct:
-			# The value content type has changed. Clear the old value, if there was one.
-			if self._cached_value:
-				self._cached_value.delete()
+			# The value content type has changed. Clear the old value, if there was one - once
+			# the attribute no longer points at it, since the value's generic relation would
+			# delete the attribute as well.
+			stale_value = self._cached_value
 			
 			# Clear the submitted value, if any.
 			self.cleaned_data.pop('value', None)
@@ -44,6 +56,8 @@ class AttributeForm(ModelForm):
 			# know what fields to add.
 			if self.instance.value_content_type is not None:
 				self.instance.value = self.instance.value_content_type.model_class().objects.create()
+			else:
+				self.instance.value_object_id = None
 		elif self.instance.value is not None:
 			# The value content type is the same, but one of the value fields has changed.
 			
@@ -53,7 +67,21 @@ class AttributeForm(ModelForm):
 				self.instance.value.construct_instance(**dict([(key, self.cleaned_data[key]) for key in fields]))
 				self.instance.value.save()
 		
-		return super(AttributeForm, self).save(*args, **kwargs)
+		instance = super(AttributeForm, self).save(*args, **kwargs)
+		if stale_value is not None:
+			commit = kwargs.get('commit', True)
+			if args:
+				commit = args[0]
+			if commit:
+				stale_value.delete()
+			else:
+				# The instance will be saved later, followed by a call to save_m2m.
+				save_m2m = self.save_m2m
+				def delete_stale_value():
+					save_m2m()
+					stale_value.delete()
+				self.save_m2m = delete_stale_value
+		return instance
 	
 	class Meta:
 		model = Attribute
@@ -10,14 +10,13 @@ from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models.query import QuerySet
 from django.http import HttpResponse, Http404
 from django.utils.encoding import force_unicode
 
 from philo.contrib.julian.feedgenerator import ICalendarFeed
 from philo.contrib.penfield.models import FeedView, FEEDS
 from philo.exceptions import ViewCanNotProvideSubpath
-from philo.models import Tag, Entity, Page
+from philo.models import Tag, Entity, EntityQuerySet, Page
 from philo.models.fields import TemplateField
 from philo.utils import ContentTypeRegistryLimiter
 
@@ -96,7 +95,7 @@ class EventManager(models.Manager):
 	def get_query_set(self):
 		return EventQuerySet(self.model)
 
-class EventQuerySet(QuerySet):
+class EventQuerySet(EntityQuerySet):
 	def upcoming(self):
 		return self.filter(start_date__gte=datetime.date.today())
 	def current(self):
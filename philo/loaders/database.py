@@ -1,8 +1,9 @@
 from django.template import TemplateDoesNotExist
-from django.template.loader import BaseLoader
+from django.template.loader import BaseLoader, get_template_from_string, make_origin
 from django.utils.encoding import smart_unicode
 
 from philo.models import Template
+from philo.models.pages import get_template_versions
 
 
 class Loader(BaseLoader):
@@ -17,4 +18,68 @@ class Loader(BaseLoader):
 			template = Template.objects.get_with_path(template_name)
 		except Template.DoesNotExist:
 			raise TemplateDoesNotExist(template_name)
-		return (template.code, smart_unicode(template))
\ No newline at end of file
+		return (template.code, smart_unicode(template))
+
+
+class CachedLoader(Loader):
+	"""
+	:class:`philo.loaders.database.CachedLoader` behaves like :class:`Loader`, but keeps the compiled templates in the current process, keyed by path, so that repeated ``{% include %}`` and ``{% extends %}`` tags neither query the database nor parse the template again. Paths are resolved through an index of every :class:`.Template`'s :attr:`~.SlugTreeEntity.full_path`, which is built with a single query.
+	
+	The index and all compiled templates are discarded as soon as any :class:`.Template` is saved, moved, or deleted in any process sharing the same cache backend. Since a compiled template holds on to the templates it extends and includes, this also covers templates which depend on a changed one. Checking for changes costs one cache lookup per loaded template.
+	
+	To use it, replace ``philo.loaders.database.Loader`` in your :setting:`TEMPLATE_LOADERS` with ``philo.loaders.database.CachedLoader``.
+	
+	"""
+	def __init__(self, *args, **kwargs):
+		super(CachedLoader, self).__init__(*args, **kwargs)
+		self.reset()
+	
+	def get_version(self):
+		"""Returns the current versions of the markers which are bumped whenever a :class:`.Template` is saved, moved, or deleted."""
+		return get_template_versions()
+	
+	def get_path_index(self):
+		"""Returns a dictionary mapping the :attr:`~.SlugTreeEntity.full_path` of every :class:`.Template` to its pk."""
+		return self._get_path_index(self._version)
+	
+	def _get_path_index(self, version):
+		# Builds the index if necessary, but only keeps it if the loader hasn't
+		# been reset for another version in the meantime.
+		path_index = self._path_index
+		if path_index is None:
+			path_index = dict(Template.objects.values_list('full_path', 'pk'))
+			if self._version == version:
+				self._path_index = path_index
+		return path_index
+	
+	def load_template(self, template_name, template_dirs=None):
+		# Other threads may reset the loader at any time, so the version and the
+		# template cache are captured once, and a compiled template is only
+		# stored if the loader still belongs to the same version.
+		version = self.get_version()
+		if version != self._version:
+			self.reset(version)
+		templates = self._templates
+		
+		path = '/'.join([segment for segment in template_name.split('/') if segment])
+		try:
+			return templates[path], None
+		except KeyError:
+			pass
+		
+		try:
+			template = Template.objects.get(pk=self._get_path_index(version)[path])
+		except (KeyError, Template.DoesNotExist):
+			raise TemplateDoesNotExist(template_name)
+		
+		origin = make_origin(smart_unicode(template), self.load_template_source, template_name, template_dirs)
+		compiled = get_template_from_string(template.code, origin, template_name)
+		if self._version == version:
+			templates[path] = compiled
+		return compiled, None
+	
+	def reset(self, version=None):
+		"""Empties the loader's path index and template cache. ``version`` is recorded as the version of the markers returned by :meth:`get_version` which the emptied caches will be filled for."""
+		self._path_index = None
+		self._templates = {}
+		self._version = version
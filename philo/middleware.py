@@ -4,10 +4,15 @@ from django.http import Http404
 
 from philo.models import Node, View
 from philo.utils.lazycompat import SimpleLazyObject
+from philo.views import cache_response
+
+
+#: Whether :func:`get_node` should resolve paths using the per-process routing table maintained by :meth:`.NodeManager.get_routing_table` instead of querying the database. This is controlled by the ``PHILO_NODE_ROUTING_TABLE`` setting. Default: ``False``.
+USE_ROUTING_TABLE = getattr(settings, 'PHILO_NODE_ROUTING_TABLE', False)
 
 
 def get_node(path):
-	"""Returns a :class:`Node` instance at ``path`` (relative to the current site) or ``None``."""
+	"""Returns a :class:`Node` instance at ``path`` (relative to the current site) or ``None``. If :data:`USE_ROUTING_TABLE` is ``True``, the :class:`Node` will be found with :meth:`.NodeManager.get_with_routing_table`; otherwise, :meth:`.TreeEntityManager.get_with_path` will be used."""
 	try:
 		current_site = Site.objects.get_current()
 	except Site.DoesNotExist:
@@ -17,8 +22,13 @@ def get_node(path):
 	if path[-1] == '/':
 		trailing_slash = True
 	
+	root = getattr(current_site, 'root_node', None)
+	
 	try:
-		node, subpath = Node.objects.get_with_path(path, root=getattr(current_site, 'root_node', None), absolute_result=False)
+		if USE_ROUTING_TABLE:
+			node, subpath = Node.objects.get_with_routing_table(path, root=root)
+		else:
+			node, subpath = Node.objects.get_with_path(path, root=root, absolute_result=False)
 	except Node.DoesNotExist:
 		return None
 	
@@ -68,4 +78,15 @@ class RequestNodeMiddleware(object):
 		extra_context = {'exception': exception}
 		response = error_view.render_to_response(request, extra_context)
 		response.status_code = status_code
+		return response
+
+
+class ResponseCacheMiddleware(object):
+	"""
+	Stores the responses which :func:`philo.views.cache_node_response` rendered for cacheable requests in the response cache, using :func:`philo.views.cache_response`. Cookies and Vary headers which make a response specific to a visitor, such as the CSRF cookie or ``Vary: Cookie``, are added by other middleware after the view has returned, so :class:`ResponseCacheMiddleware` must be listed *before* :class:`~django.contrib.sessions.middleware.SessionMiddleware`, :class:`~django.middleware.csrf.CsrfViewMiddleware`, and :class:`~django.contrib.messages.middleware.MessageMiddleware` in :setting:`settings.MIDDLEWARE_CLASSES` - usually first - to see the response after they have processed it.
+	
+	"""
+	def process_response(self, request, response):
+		if getattr(request, '_cache_node_response', False):
+			cache_response(request, response)
 		return response
\ No newline at end of file
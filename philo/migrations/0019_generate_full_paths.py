@@ -0,0 +1,151 @@
+# encoding: utf-8
+import datetime
+from hashlib import sha1
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+from django.utils.encoding import smart_str
+
+class Migration(DataMigration):
+
+	def forwards(self, orm):
+		"Populate the full paths of all nodes and templates."
+		for model in (orm.Node, orm.Template):
+			paths = {}
+			for obj in model.objects.order_by('tree_id', 'lft'):
+				if obj.parent_id is None:
+					full_path = obj.slug
+				else:
+					full_path = '%s/%s' % (paths[obj.parent_id], obj.slug)
+				paths[obj.pk] = full_path
+				model.objects.filter(pk=obj.pk).update(full_path=full_path, full_path_hash=sha1(smart_str(full_path)).hexdigest())
+
+
+	def backwards(self, orm):
+		"Write your backwards methods here."
+		pass
+
+
+	models = {
+		'contenttypes.contenttype': {
+			'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+			'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+			'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+		},
+		'philo.attribute': {
+			'Meta': {'unique_together': "(('key', 'entity_content_type', 'entity_object_id'), ('value_content_type', 'value_object_id'))", 'object_name': 'Attribute'},
+			'entity_content_type': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'attribute_entity_set'", 'to': "orm['contenttypes.ContentType']"}),
+			'entity_object_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'key': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+			'value_content_type': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'attribute_value_set'", 'null': 'True', 'to': "orm['contenttypes.ContentType']"}),
+			'value_object_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'})
+		},
+		'philo.collection': {
+			'Meta': {'object_name': 'Collection'},
+			'description': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+		},
+		'philo.collectionmember': {
+			'Meta': {'object_name': 'CollectionMember'},
+			'collection': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'members'", 'to': "orm['philo.Collection']"}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'index': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+			'member_content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+			'member_object_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+		},
+		'philo.contentlet': {
+			'Meta': {'object_name': 'Contentlet'},
+			'content': ('philo.models.fields.TemplateField', [], {}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'name': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+			'page': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'contentlets'", 'to': "orm['philo.Page']"})
+		},
+		'philo.contentreference': {
+			'Meta': {'object_name': 'ContentReference'},
+			'content_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+			'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'name': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+			'page': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'contentreferences'", 'to': "orm['philo.Page']"})
+		},
+		'philo.file': {
+			'Meta': {'object_name': 'File'},
+			'file': ('django.db.models.fields.files.FileField', [], {'max_length': '100'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'mimetype': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+			'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+		},
+		'philo.foreignkeyvalue': {
+			'Meta': {'object_name': 'ForeignKeyValue'},
+			'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'})
+		},
+		'philo.jsonvalue': {
+			'Meta': {'object_name': 'JSONValue'},
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'value': ('philo.models.fields.JSONField', [], {'default': "'null'", 'db_index': 'True'})
+		},
+		'philo.manytomanyvalue': {
+			'Meta': {'object_name': 'ManyToManyValue'},
+			'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'values': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'to': "orm['philo.ForeignKeyValue']", 'null': 'True', 'blank': 'True'})
+		},
+		'philo.node': {
+			'Meta': {'unique_together': "(('parent', 'slug'),)", 'object_name': 'Node'},
+			'full_path': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+			'full_path_hash': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '40', 'blank': 'True'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'level': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'lft': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'parent': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'children'", 'null': 'True', 'to': "orm['philo.Node']"}),
+			'rght': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'slug': ('django.db.models.fields.SlugField', [], {'max_length': '255', 'db_index': 'True'}),
+			'tree_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'view_content_type': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'node_view_set'", 'null': 'True', 'to': "orm['contenttypes.ContentType']"}),
+			'view_object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'})
+		},
+		'philo.page': {
+			'Meta': {'object_name': 'Page'},
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'template': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'pages'", 'to': "orm['philo.Template']"}),
+			'title': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+		},
+		'philo.redirect': {
+			'Meta': {'object_name': 'Redirect'},
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'reversing_parameters': ('philo.models.fields.JSONField', [], {'blank': 'True'}),
+			'status_code': ('django.db.models.fields.IntegerField', [], {'default': '302'}),
+			'target_node': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'philo_redirect_related'", 'null': 'True', 'to': "orm['philo.Node']"}),
+			'url_or_subpath': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'})
+		},
+		'philo.tag': {
+			'Meta': {'ordering': "('name',)", 'object_name': 'Tag'},
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+			'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '255', 'db_index': 'True'})
+		},
+		'philo.template': {
+			'Meta': {'unique_together': "(('parent', 'slug'),)", 'object_name': 'Template'},
+			'code': ('philo.models.fields.TemplateField', [], {}),
+			'documentation': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+			'full_path': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+			'full_path_hash': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '40', 'blank': 'True'}),
+			'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+			'level': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'lft': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'mimetype': ('django.db.models.fields.CharField', [], {'default': "'text/html'", 'max_length': '255'}),
+			'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+			'parent': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'children'", 'null': 'True', 'to': "orm['philo.Template']"}),
+			'rght': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+			'slug': ('django.db.models.fields.SlugField', [], {'max_length': '255', 'db_index': 'True'}),
+			'tree_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'})
+		}
+	}
+
+	complete_apps = ['philo']
@@ -1,22 +1,34 @@
+from hashlib import sha1
+import operator
+
 from django import forms
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, connections, router, transaction
+from django.db.models.query import QuerySet
 from django.utils import simplejson as json
-from django.utils.encoding import force_unicode
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_unicode, smart_str
 from mptt.models import MPTTModel, MPTTModelBase, MPTTOptions
 
 from philo.exceptions import AncestorDoesNotExist
-from philo.models.fields import JSONField
+from philo.models.fields import JSONField, dump_json
 from philo.signals import entity_class_prepared
-from philo.utils import ContentTypeRegistryLimiter, ContentTypeSubclassLimiter
-from philo.utils.entities import AttributeMapper, TreeAttributeMapper
+from philo.utils import ContentTypeRegistryLimiter, ContentTypeSubclassLimiter, get_cache_version, bump_cache_version, make_object_version_key, make_model_version_key
+from philo.utils.entities import AttributeMapper, CachedAttributeMapper, TreeAttributeMapper, PassthroughAttributeMapper, ClosureAttributeMapper, LazyAttributeMapperMixin, USE_ATTRIBUTE_CACHE
 from philo.validators import json_validator
 
 
-__all__ = ('Tag', 'value_content_type_limiter', 'register_value_model', 'unregister_value_model', 'JSONValue', 'ForeignKeyValue', 'ManyToManyValue', 'Attribute', 'Entity', 'TreeEntity', 'SlugTreeEntity')
+__all__ = ('Tag', 'value_content_type_limiter', 'register_value_model', 'unregister_value_model', 'JSONValue', 'ForeignKeyValue', 'ManyToManyValue', 'Attribute', 'InheritedAttribute', 'prefetch_attributes', 'set_attribute_values', 'EntityQuerySet', 'EntityManager', 'Entity', 'TreeEntity', 'SlugTreeEntity')
+
+
+#: Whether :class:`InheritedAttribute` rows should be maintained for :class:`TreeEntity` subclasses and used by their :attr:`~Entity.attributes`. This is controlled by the ``PHILO_ATTRIBUTE_CLOSURE`` setting. Default: ``False``. Existing trees can be populated with :func:`rebuild_attribute_closure`.
+USE_ATTRIBUTE_CLOSURE = getattr(settings, 'PHILO_ATTRIBUTE_CLOSURE', False)
+#: Whether :meth:`Attribute.set_value` should store :class:`JSONValue` values directly on the :class:`Attribute` row, in :attr:`Attribute.inline_value`. This is controlled by the ``PHILO_INLINE_JSON_VALUES`` setting. Default: ``False``. Inline values are read regardless of this setting.
+USE_INLINE_JSON_VALUES = getattr(settings, 'PHILO_INLINE_JSON_VALUES', False)
 
 
 class Tag(models.Model):
@@ -92,9 +104,16 @@ class AttributeValue(models.Model):
 attribute_value_limiter = ContentTypeSubclassLimiter(AttributeValue)
 
 
+def make_json_hash(value_json):
+	"""Returns the hash which is stored alongside the JSON string ``value_json`` in :attr:`JSONValue.value_hash` and :attr:`Attribute.inline_value_hash`, so that values can be looked up with an index on a short column rather than on unbounded text."""
+	return sha1(smart_str(value_json)).hexdigest()
+
+
 class JSONValue(AttributeValue):
 	"""Stores a python object as a json string."""
 	value = JSONField(verbose_name='Value (JSON)', help_text='This value must be valid JSON.', default='null', db_index=True)
+	#: The :func:`make_json_hash` of the serialized :attr:`value`. This is maintained automatically.
+	value_hash = models.CharField(max_length=40, editable=False, blank=True, db_index=True)
 	
 	def __unicode__(self):
 		return force_unicode(self.value)
@@ -173,33 +192,70 @@ class ManyToManyValue(AttributeValue):
 		if self.pk is None:
 			self.save()
 		
-		object_ids = value.values_list('id', flat=True)
+		object_ids = list(value.values_list('id', flat=True))
+		new_ids = set(object_ids)
+		
+		# Work out the difference between the current and the new relations
+		# once, then delete the stale values in one query and add the missing
+		# ones in bulk.
+		current_ids = set()
+		stale_pks = []
+		for pk, content_type_id, object_id in self.values.values_list('pk', 'content_type', 'object_id'):
+			if content_type_id == self.content_type.pk and object_id in new_ids and object_id not in current_ids:
+				current_ids.add(object_id)
+			else:
+				stale_pks.append(pk)
+		
+		if stale_pks:
+			ForeignKeyValue.objects.filter(pk__in=stale_pks).delete()
+		
+		missing_ids = []
+		for object_id in object_ids:
+			if object_id in current_ids:
+				continue
+			current_ids.add(object_id)
+			missing_ids.append(object_id)
 		
-		# These lines shouldn't be necessary; however, if object_ids is an EmptyQuerySet,
-		# the code (specifically the object_id__in query) won't work without them. Unclear why...
-		# TODO: is this still the case?
+		if missing_ids:
+			self._add_values(self._create_values(missing_ids))
+	
+	def _create_values(self, object_ids):
+		# Creates a ForeignKeyValue for each of the given object_ids and
+		# returns their pks. The rows are created one at a time, since Django
+		# 1.3 can't return the pks of a bulk insert and there is no safe way
+		# to find them again afterwards; only the relations are inserted in
+		# bulk.
+		content_type = self.content_type
+		return [ForeignKeyValue.objects.create(content_type=content_type, object_id=object_id).pk for object_id in object_ids]
+	
+	def _add_values(self, pks):
+		# Relates the ForeignKeyValues with the given pks to this instance with
+		# a single executemany, rather than the query-per-row of values.add().
+		# The m2m_changed signals are sent as the related manager would.
+		through = self._meta.get_field('values').rel.through
+		using = router.db_for_write(through, instance=self)
+		pk_set = set(pks)
+		
+		models.signals.m2m_changed.send(sender=through, action='pre_add', instance=self, reverse=False, model=ForeignKeyValue, pk_set=pk_set, using=using)
+		_insert_many(through, ('manytomanyvalue', 'foreignkeyvalue'), [(self.pk, pk) for pk in pks])
+		models.signals.m2m_changed.send(sender=through, action='post_add', instance=self, reverse=False, model=ForeignKeyValue, pk_set=pk_set, using=using)
+	
+	def get_value_for_object_ids(self, object_ids):
+		"""Returns the value this :class:`ManyToManyValue` would have if it were related to the given ``object_ids``, without querying for its actual relations. This is used by :func:`prefetch_attributes`."""
+		if self.content_type_id is None:
+			return None
+		manager = ContentType.objects.get_for_id(self.content_type_id).model_class()._default_manager
 		if not object_ids:
-			self.values.all().delete()
-		else:
-			self.values.exclude(object_id__in=object_ids, content_type=self.content_type).delete()
-			
-			current_ids = self.object_ids
-			
-			for object_id in object_ids:
-				if object_id in current_ids:
-					continue
-				self.values.create(content_type=self.content_type, object_id=object_id)
+			return manager.none()
+		return manager.filter(id__in=object_ids)
 	
 	def get_value(self):
-		if self.content_type is None:
+		if self.content_type_id is None:
 			return None
 		
 		# HACK to be safely explicit until http://code.djangoproject.com/ticket/15145 is resolved
-		object_ids = self.object_ids
-		manager = self.content_type.model_class()._default_manager
-		if not object_ids:
-			return manager.none()
-		return manager.filter(id__in=self.object_ids)
+		# The ids are evaluated once and reused for the filter.
+		return self.get_value_for_object_ids(list(self.object_ids))
 	
 	value = property(get_value, set_value)
 	
@@ -255,29 +311,518 @@ class Attribute(models.Model):
 	#: :class:`CharField` containing a key (up to 255 characters) consisting of alphanumeric characters and underscores.
 	key = models.CharField(max_length=255, validators=[RegexValidator("\w+")], help_text="Must contain one or more alphanumeric characters or underscores.", db_index=True)
 	
+	#: :class:`~philo.models.fields.JSONField` which holds the value of an :class:`Attribute` that has no related :attr:`value`. See :data:`USE_INLINE_JSON_VALUES`.
+	inline_value = JSONField(verbose_name='Inline value (JSON)', default='null', blank=True)
+	#: The :func:`make_json_hash` of the serialized :attr:`inline_value`. This is maintained automatically.
+	inline_value_hash = models.CharField(max_length=40, editable=False, blank=True, db_index=True)
+	
 	def __unicode__(self):
+		if self.value_content_type_id is None:
+			return u'"%s": %s' % (self.key, force_unicode(self.inline_value))
 		return u'"%s": %s' % (self.key, self.value)
 	
+	def get_python_value(self):
+		"""Returns the python value of the :class:`Attribute`: the ``value`` of its related :attr:`value` or, if it has none, its :attr:`inline_value`."""
+		if self.value_content_type_id is None:
+			return self.inline_value
+		return getattr(self.value, 'value', None)
+	
 	def set_value(self, value, value_class=JSONValue):
-		"""Given a value and a value class, sets up self.value appropriately."""
-		if isinstance(self.value, value_class):
-			val = self.value
+		"""Given a value and a value class, sets up self.value appropriately. If ``value_class`` is :class:`JSONValue` and :data:`USE_INLINE_JSON_VALUES` is ``True``, the value will instead be stored in :attr:`inline_value` and any related value will be deleted, so that only the :class:`Attribute` itself needs to be saved."""
+		old_value = None
+		if value_class is JSONValue and USE_INLINE_JSON_VALUES:
+			if self.value_content_type_id is not None:
+				old_value = self.value
+				self.value = None
+			self.inline_value = value
+			self.save()
 		else:
-			if isinstance(self.value, models.Model):
-				self.value.delete()
-			val = value_class()
-		
-		val.set_value(value)
-		val.save()
+			self.inline_value = None
+			if isinstance(self.value, value_class):
+				val = self.value
+			else:
+				old_value = self.value
+				val = value_class()
+			
+			val.set_value(value)
+			val.save()
+			
+			self.value = val
+			self.save()
 		
-		self.value = val
-		self.save()
+		# Delete a replaced value only once the Attribute no longer points at it;
+		# otherwise the value's generic relation would delete the Attribute too.
+		if isinstance(old_value, models.Model):
+			old_value.delete()
 	
 	class Meta:
 		app_label = 'philo'
 		unique_together = (('key', 'entity_content_type', 'entity_object_id'), ('value_content_type', 'value_object_id'))
 
 
+class InheritedAttribute(models.Model):
+	"""
+	Records which :class:`Attribute` a key resolves to for a :class:`TreeEntity` instance once inheritance from its ancestors is taken into account. These rows are only maintained if :data:`USE_ATTRIBUTE_CLOSURE` is ``True``; they let a single indexed query return an instance's effective attributes, and make it possible to query for instances by the value they inherit with :meth:`EntityQuerySet.filter_attribute`. For example, to find all :class:`.Node`\ s whose effective ``theme`` is ``"dark"``::
+	
+		>>> Node.objects.filter_attribute('theme', 'dark', inherited=True)
+	
+	"""
+	entity_content_type = models.ForeignKey(ContentType, related_name='inherited_attribute_set')
+	entity_object_id = models.PositiveIntegerField(db_index=True)
+	#: The key of the effective :class:`Attribute`.
+	key = models.CharField(max_length=255)
+	#: The :class:`Attribute` which ``key`` resolves to for the entity. This may be attached to the entity itself or to one of its ancestors.
+	attribute = models.ForeignKey(Attribute, related_name='inherited_by')
+	
+	def __unicode__(self):
+		return u'%s:%s "%s"' % (self.entity_content_type_id, self.entity_object_id, self.key)
+	
+	class Meta:
+		app_label = 'philo'
+		unique_together = (('entity_content_type', 'entity_object_id', 'key'),)
+
+
+def get_entity_version():
+	"""Returns an opaque marker which changes whenever any :class:`Entity`, :class:`Attribute`, or :class:`AttributeValue` is saved or deleted. See :func:`~philo.utils.get_cache_version`."""
+	return get_cache_version('entities')
+
+
+def bump_entity_version(sender, **kwargs):
+	"""Connected to the post_save and post_delete signals of every concrete :class:`Entity` subclass, :class:`Attribute`, and the built-in :class:`AttributeValue` subclasses. Replaces the marker returned by :func:`get_entity_version`."""
+	bump_cache_version('entities')
+
+
+def bump_object_version(sender, instance, **kwargs):
+	"""Connected to the post_save and post_delete signals of every concrete :class:`Entity` subclass. Replaces the instance's version marker (see :func:`~philo.utils.make_object_version_key`) and that of its model."""
+	content_type_id = ContentType.objects.get_for_model(sender).pk
+	bump_cache_version(make_object_version_key(content_type_id, instance.pk))
+	bump_cache_version(make_model_version_key(content_type_id))
+
+
+def bump_attribute_entity_version(sender, instance, **kwargs):
+	"""Connected to the post_save and post_delete signals of :class:`Attribute`. Replaces the version marker of the attribute's entity, since its :attr:`~Entity.attributes` have changed."""
+	bump_cache_version(make_object_version_key(instance.entity_content_type_id, instance.entity_object_id))
+
+
+def bump_value_entity_version(sender, instance, **kwargs):
+	"""Connected to the post_save signals of the built-in :class:`AttributeValue` subclasses and to the m2m_changed signal of :attr:`ManyToManyValue.values`. Replaces the version markers of the entities whose :class:`Attribute`\ s use the value, since values can be changed without saving their :class:`Attribute`."""
+	if kwargs.get('created'):
+		# A newly-created value can't be in use by any Attribute yet.
+		return
+	if kwargs.get('action', 'post_add') not in ('post_add', 'post_remove', 'post_clear'):
+		# Only act once per change to the values of a ManyToManyValue.
+		return
+	for content_type_id, object_id in instance.attribute_set.values_list('entity_content_type', 'entity_object_id'):
+		bump_cache_version(make_object_version_key(content_type_id, object_id))
+
+
+def update_json_hash(sender, instance, raw=False, **kwargs):
+	"""Connected to the pre_save signals of :class:`JSONValue` and :class:`Attribute`. Updates :attr:`JSONValue.value_hash` or :attr:`Attribute.inline_value_hash`. For raw saves, such as fixture loading, the JSON is serialized again first, so that it is normalized as :func:`~philo.models.fields.dump_json` would store it."""
+	if isinstance(instance, JSONValue):
+		if raw:
+			instance.value = instance.value
+		instance.value_hash = make_json_hash(instance.value_json)
+	else:
+		if raw:
+			instance.inline_value = instance.inline_value
+		instance.inline_value_hash = make_json_hash(instance.inline_value_json)
+
+
+models.signals.pre_save.connect(update_json_hash, sender=JSONValue)
+models.signals.pre_save.connect(update_json_hash, sender=Attribute)
+for model in (Attribute, JSONValue, ForeignKeyValue, ManyToManyValue):
+	models.signals.post_save.connect(bump_entity_version, sender=model)
+	models.signals.post_delete.connect(bump_entity_version, sender=model)
+models.signals.post_save.connect(bump_attribute_entity_version, sender=Attribute)
+models.signals.post_delete.connect(bump_attribute_entity_version, sender=Attribute)
+for model in (JSONValue, ForeignKeyValue, ManyToManyValue):
+	models.signals.post_save.connect(bump_value_entity_version, sender=model)
+models.signals.m2m_changed.connect(bump_value_entity_version, sender=ManyToManyValue.values.through)
+
+
+def _get_ancestor_levels(model, entities):
+	# Returns a dictionary mapping the pk of each of the given entities to a
+	# dictionary mapping the pks of its ancestors (including itself) to their
+	# levels, using a single query.
+	opts = model._mptt_meta
+	fields = (opts.tree_id_attr, opts.left_attr, opts.right_attr)
+	query = reduce(operator.or_, [models.Q(**{
+		fields[0]: getattr(entity, fields[0]),
+		'%s__lte' % fields[1]: getattr(entity, fields[1]),
+		'%s__gte' % fields[2]: getattr(entity, fields[2]),
+	}) for entity in entities])
+	rows = list(model._default_manager.filter(query).values_list('pk', opts.level_attr, *fields))
+	
+	levels = {}
+	for entity in entities:
+		tree_id, left, right = [getattr(entity, field) for field in fields]
+		levels[entity.pk] = dict([(row[0], row[1]) for row in rows if row[2] == tree_id and row[3] <= left and row[4] >= right])
+	return levels
+
+
+def prefetch_attributes(entities, keys=None):
+	"""
+	Loads the :class:`Attribute`\ s and values for all of the given :class:`Entity` instances and seeds the cache of each instance's :attr:`~Entity.attributes` mapper, so that no further queries are needed to read them. Instances whose mappers use a :class:`.TreeAttributeMapper` will have their ancestors' :class:`Attribute`\ s loaded as well. The number of queries is independent of the number of instances: one for :class:`Attribute`\ s, one per model for ancestors, one per value model, one per model referenced by :class:`ForeignKeyValue`\ s, and one for the relations of :class:`ManyToManyValue`\ s. The values of :class:`ManyToManyValue`\ s are returned as unevaluated querysets, as usual.
+	
+	:param entities: An iterable of :class:`Entity` subclass instances.
+	:param keys: If provided, only :class:`Attribute`\ s with these keys will be loaded for instances with lazy mappers (see :class:`.LazyAttributeMapperMixin`), and keys without an :class:`Attribute` will be remembered as missing. Other mappers load all :class:`Attribute`\ s at their first lookup anyway, so they are always seeded in full.
+	
+	"""
+	if keys is not None:
+		keys = set(keys)
+	mappers = []
+	lookups = {}
+	keyed_lookups = {}
+	keyed_entities = set()
+	tree_entities = {}
+	for entity in entities:
+		mapper = entity.attributes
+		if isinstance(mapper, PassthroughAttributeMapper):
+			continue
+		ct = ContentType.objects.get_for_model(entity)
+		keyed = keys is not None and isinstance(mapper, LazyAttributeMapperMixin)
+		mappers.append((ct, entity, mapper, keyed))
+		if keyed:
+			keyed_entities.add((ct.pk, entity.pk))
+			keyed_lookups.setdefault(ct, set()).add(entity.pk)
+		else:
+			lookups.setdefault(ct, set()).add(entity.pk)
+		if isinstance(mapper, TreeAttributeMapper):
+			tree_entities.setdefault(entity.__class__, []).append(entity)
+	
+	if not mappers:
+		return
+	
+	ancestor_levels = {}
+	for model, model_entities in tree_entities.items():
+		ct = ContentType.objects.get_for_model(model)
+		for pk, levels in _get_ancestor_levels(model, model_entities).items():
+			ancestor_levels[(ct.pk, pk)] = levels
+			if (ct.pk, pk) in keyed_entities:
+				keyed_lookups[ct].update(levels.keys())
+			else:
+				lookups[ct].update(levels.keys())
+	
+	q = [models.Q(entity_content_type=content_type, entity_object_id__in=pks) for content_type, pks in lookups.items()]
+	q.extend([models.Q(entity_content_type=content_type, entity_object_id__in=pks, key__in=keys) for content_type, pks in keyed_lookups.items()])
+	attributes = list(Attribute.objects.filter(reduce(operator.or_, q)))
+	
+	attributes_by_entity = {}
+	value_lookups = {}
+	for attribute in attributes:
+		attributes_by_entity.setdefault((attribute.entity_content_type_id, attribute.entity_object_id), []).append(attribute)
+		if attribute.value_content_type_id is not None:
+			value_lookups.setdefault(attribute.value_content_type_id, []).append(attribute.value_object_id)
+	
+	values_bulk = {}
+	target_lookups = {}
+	m2m_values = []
+	for ct_id, pks in value_lookups.items():
+		values_bulk[ct_id] = ContentType.objects.get_for_id(ct_id).model_class()._default_manager.in_bulk(pks)
+		for value in values_bulk[ct_id].values():
+			if isinstance(value, ForeignKeyValue):
+				if value.content_type_id is not None and value.object_id is not None:
+					target_lookups.setdefault(value.content_type_id, set()).add(value.object_id)
+			elif isinstance(value, ManyToManyValue):
+				m2m_values.append(value)
+	
+	targets = {}
+	for ct_id, pks in target_lookups.items():
+		targets[ct_id] = ContentType.objects.get_for_id(ct_id).model_class()._base_manager.in_bulk(list(pks))
+	
+	object_ids = {}
+	if m2m_values:
+		relations = ManyToManyValue.values.through._default_manager.filter(manytomanyvalue__in=[value.pk for value in m2m_values])
+		for m2m_pk, object_id in relations.values_list('manytomanyvalue', 'foreignkeyvalue__object_id'):
+			object_ids.setdefault(m2m_pk, []).append(object_id)
+	
+	python_values = {}
+	for attribute in attributes:
+		value = values_bulk.get(attribute.value_content_type_id, {}).get(attribute.value_object_id)
+		setattr(attribute, Attribute.value.cache_attr, value)
+		if isinstance(value, ForeignKeyValue):
+			target = targets.get(value.content_type_id, {}).get(value.object_id)
+			setattr(value, ForeignKeyValue.value.cache_attr, target)
+			python_values[attribute.pk] = target
+		elif isinstance(value, ManyToManyValue):
+			python_values[attribute.pk] = value.get_value_for_object_ids(object_ids.get(value.pk, []))
+		else:
+			python_values[attribute.pk] = attribute.get_python_value()
+	
+	for ct, entity, mapper, keyed in mappers:
+		levels = ancestor_levels.get((ct.pk, entity.pk))
+		if levels is None:
+			entity_attributes = attributes_by_entity.get((ct.pk, entity.pk), [])
+		else:
+			entity_attributes = []
+			for pk in levels:
+				entity_attributes.extend(attributes_by_entity.get((ct.pk, pk), []))
+			entity_attributes.sort(key=lambda a: levels[a.entity_object_id])
+		
+		if keyed:
+			# Ancestors may be shared with fully seeded mappers, so attributes
+			# with other keys may have been loaded without their overrides.
+			entity_attributes = [attribute for attribute in entity_attributes if attribute.key in keys]
+		
+		for attribute in entity_attributes:
+			mapper._attributes_cache[attribute.key] = attribute
+			mapper._cache[attribute.key] = python_values[attribute.pk]
+		if keyed:
+			mapper._missing_keys.update(keys.difference(mapper._cache))
+		else:
+			mapper._cache_filled = True
+
+
+def _execute_many(model, sql, rows):
+	# Runs ``sql`` once for each of ``rows`` with a single executemany against
+	# the database ``model`` is written to. Used where Django 1.3 has no bulk
+	# equivalent; no signals are sent.
+	using = router.db_for_write(model)
+	cursor = connections[using].cursor()
+	cursor.executemany(sql, rows)
+	transaction.commit_unless_managed(using=using)
+	return using
+
+
+def _insert_many(model, fields, rows):
+	# Each row holds the database values of the named fields.
+	qn = connections[router.db_for_write(model)].ops.quote_name
+	columns = [qn(model._meta.get_field(name).column) for name in fields]
+	sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(model._meta.db_table), ", ".join(columns), ", ".join(["%s"] * len(columns)))
+	return _execute_many(model, sql, rows)
+
+
+def _update_many(model, fields, rows):
+	# Each row holds the database values of the named fields followed by the pk
+	# of the row to update.
+	qn = connections[router.db_for_write(model)].ops.quote_name
+	assignments = ["%s = %%s" % qn(model._meta.get_field(name).column) for name in fields]
+	sql = "UPDATE %s SET %s WHERE %s = %%s" % (qn(model._meta.db_table), ", ".join(assignments), qn(model._meta.pk.column))
+	return _execute_many(model, sql, rows)
+
+
+def set_attribute_values(entity, values):
+	"""
+	Sets the values of many of ``entity``'s :class:`Attribute`\ s at once, creating any which don't exist yet, as :meth:`Attribute.set_value` would for each key. The existing :class:`Attribute`\ s are loaded with one query, and values which can be updated in place are written with one bulk update per value model. :class:`Attribute`\ s with an :attr:`~Attribute.inline_value` are created in bulk as well. Other new values and :class:`Attribute`\ s, and the relations of :class:`ManyToManyValue`\ s, still cost queries of their own. The caller is responsible for any transaction handling.
+	
+	:param entity: A saved :class:`Entity` subclass instance.
+	:param values: An iterable of ``(key, value, value_class)`` tuples, where ``value_class`` is the :class:`AttributeValue` subclass which should hold ``value``. If a key is given more than once, the last value wins.
+	:returns: A dictionary mapping each key to its saved :class:`Attribute`, with the :class:`Attribute`'s value attached.
+	
+	"""
+	values = list(values)
+	if not values:
+		return {}
+	
+	ct = ContentType.objects.get_for_model(entity)
+	attributes = dict([(attribute.key, attribute) for attribute in Attribute.objects.filter(entity_content_type=ct, entity_object_id=entity.pk, key__in=[key for key, value, value_class in values])])
+	
+	to_save = []
+	to_insert = SortedDict()
+	inline_updates = {}
+	value_updates = {}
+	stale = {}
+	for key, value, value_class in values:
+		try:
+			attribute = attributes[key]
+		except KeyError:
+			attribute = Attribute(key=key, entity_content_type=ct, entity_object_id=entity.pk)
+			attributes[key] = attribute
+		
+		value_ct_id = attribute.value_content_type_id
+		
+		if value_class is JSONValue and USE_INLINE_JSON_VALUES:
+			if value_ct_id is not None:
+				stale.setdefault(value_ct_id, []).append(attribute.value_object_id)
+				attribute.value = None
+			attribute.inline_value = value
+			if attribute.pk is None:
+				to_insert[key] = attribute
+			elif value_ct_id is None:
+				inline_updates[attribute.pk] = (attribute.inline_value_json, make_json_hash(attribute.inline_value_json), attribute.pk)
+			else:
+				to_save.append(attribute)
+			continue
+		
+		if value_ct_id is not None and value_ct_id == ContentType.objects.get_for_model(value_class).pk:
+			# Update the existing value in place; the Attribute itself is unchanged.
+			if value_class in (JSONValue, ForeignKeyValue, ManyToManyValue):
+				val = value_class(pk=attribute.value_object_id)
+				val.set_value(value)
+				if value_class is JSONValue:
+					row = (val.value_json, make_json_hash(val.value_json), val.pk)
+				elif value_class is ForeignKeyValue:
+					row = (val.content_type_id, val.object_id, val.pk)
+				else:
+					row = (val.content_type_id, val.pk)
+				value_updates.setdefault(value_class, {})[val.pk] = row
+				setattr(attribute, Attribute.value.cache_attr, val)
+			else:
+				val = attribute.value
+				val.set_value(value)
+				val.save()
+		else:
+			if value_ct_id is not None:
+				stale.setdefault(value_ct_id, []).append(attribute.value_object_id)
+			val = value_class()
+			val.set_value(value)
+			if val.pk is None:
+				val.save()
+			attribute.inline_value = None
+			attribute.value = val
+			to_save.append(attribute)
+	
+	value_fields = {
+		JSONValue: ('value', 'value_hash'),
+		ForeignKeyValue: ('content_type', 'object_id'),
+		ManyToManyValue: ('content_type',),
+	}
+	for value_class, rows in value_updates.items():
+		_update_many(value_class, value_fields[value_class], rows.values())
+	
+	if inline_updates:
+		_update_many(Attribute, ('inline_value', 'inline_value_hash'), inline_updates.values())
+	
+	if to_insert:
+		for attribute in to_insert.values():
+			models.signals.pre_save.send(sender=Attribute, instance=attribute, raw=False, using=router.db_for_write(Attribute))
+		using = _insert_many(Attribute, ('entity_content_type', 'entity_object_id', 'key', 'inline_value', 'inline_value_hash'), [(ct.pk, entity.pk, attribute.key, attribute.inline_value_json, attribute.inline_value_hash) for attribute in to_insert.values()])
+		# The (entity, key) pairs are unique, so the new rows can be found again.
+		for key, pk in Attribute.objects.filter(entity_content_type=ct, entity_object_id=entity.pk, key__in=to_insert.keys()).values_list('key', 'pk'):
+			attribute = to_insert[key]
+			attribute.pk = pk
+			attribute._state.db = using
+			attribute._state.adding = False
+		for attribute in to_insert.values():
+			models.signals.post_save.send(sender=Attribute, instance=attribute, created=True, raw=False, using=using)
+	
+	for attribute in to_save:
+		attribute.save(force_update=attribute.pk is not None)
+	
+	# Replaced values are only deleted once nothing points at them, so that
+	# their generic relation doesn't take the Attribute along.
+	for value_ct_id, pks in stale.items():
+		ContentType.objects.get_for_id(value_ct_id).model_class()._default_manager.filter(pk__in=pks).delete()
+	
+	# Bulk writes don't send any signals, so invalidate here.
+	bump_cache_version(make_object_version_key(ct.pk, entity.pk))
+	bump_cache_version('entities')
+	
+	return attributes
+
+
+def _get_attribute_value_q(value):
+	# Returns a Q object matching the Attributes whose python value is
+	# ``value``. Model instances are matched against ForeignKeyValues; anything
+	# else is compared as JSON against JSONValues and inline values.
+	if isinstance(value, models.Model):
+		fk_values = ForeignKeyValue.objects.filter(content_type=ContentType.objects.get_for_model(value), object_id=value.pk)
+		return models.Q(value_content_type=ContentType.objects.get_for_model(ForeignKeyValue), value_object_id__in=fk_values.values('pk'))
+	# The indexed hashes narrow the lookup down; the JSON itself is compared as
+	# well, so that hash collisions can't cause false matches.
+	value_json = dump_json(value)
+	value_hash = make_json_hash(value_json)
+	json_values = JSONValue.objects.filter(value_hash=value_hash, value=value_json)
+	return models.Q(value_content_type=ContentType.objects.get_for_model(JSONValue), value_object_id__in=json_values.values('pk')) | models.Q(value_content_type__isnull=True, inline_value_hash=value_hash, inline_value=value_json)
+
+
+def _get_inherited_attribute_where(model, key, attributes):
+	# Returns an extra() WHERE clause and its params matching the instances of
+	# the TreeEntity subclass ``model`` which inherit one of ``attributes`` (all
+	# for ``key``): those with an ancestor (or themselves) holding one of the
+	# attributes and no nearer ancestor which defines ``key`` as well. The MPTT
+	# ranges are compared in correlated subqueries, so the number of instances
+	# declaring ``key`` doesn't affect the size of the query.
+	opts = model._mptt_meta
+	qn = connections[attributes.db].ops.quote_name
+	attribute_field = lambda name: qn(Attribute._meta.get_field(name).column)
+	model_field = lambda name: qn(model._meta.get_field(name).column)
+	matching_sql, matching_params = attributes.values('pk').query.get_compiler(using=attributes.db).as_sql()
+	sql = ("EXISTS (SELECT 1 FROM %(table)s definer INNER JOIN %(attribute_table)s definer_attribute ON (definer_attribute.%(object_id)s = definer.%(pk)s)"
+		" WHERE definer_attribute.%(attribute_pk)s IN (%(matching)s)"
+		" AND definer.%(tree_id)s = %(table)s.%(tree_id)s AND definer.%(left)s <= %(table)s.%(left)s AND definer.%(right)s >= %(table)s.%(right)s"
+		" AND NOT EXISTS (SELECT 1 FROM %(table)s nearer INNER JOIN %(attribute_table)s nearer_attribute ON (nearer_attribute.%(object_id)s = nearer.%(pk)s)"
+		" WHERE nearer_attribute.%(content_type)s = %%s AND nearer_attribute.%(key)s = %%s"
+		" AND nearer.%(tree_id)s = definer.%(tree_id)s AND nearer.%(left)s > definer.%(left)s AND nearer.%(right)s < definer.%(right)s"
+		" AND nearer.%(left)s <= %(table)s.%(left)s AND nearer.%(right)s >= %(table)s.%(right)s))") % {
+		'table': qn(model._meta.db_table),
+		'pk': qn(model._meta.pk.column),
+		'tree_id': model_field(opts.tree_id_attr),
+		'left': model_field(opts.left_attr),
+		'right': model_field(opts.right_attr),
+		'attribute_table': qn(Attribute._meta.db_table),
+		'attribute_pk': qn(Attribute._meta.pk.column),
+		'content_type': attribute_field('entity_content_type'),
+		'object_id': attribute_field('entity_object_id'),
+		'key': attribute_field('key'),
+		'matching': matching_sql,
+	}
+	return sql, list(matching_params) + [ContentType.objects.get_for_model(model).pk, key]
+
+
+class EntityQuerySet(QuerySet):
+	"""A :class:`QuerySet` for :class:`Entity` subclasses which can prefetch the instances' :class:`Attribute`\ s."""
+	_prefetch_attributes = False
+	_prefetch_attribute_keys = None
+	
+	def prefetch_attributes(self, keys=None):
+		"""Returns a clone of the queryset whose results will have their :class:`Attribute`\ s loaded in bulk with :func:`prefetch_attributes` when the queryset is evaluated."""
+		clone = self._clone()
+		clone._prefetch_attributes = True
+		clone._prefetch_attribute_keys = keys
+		return clone
+	
+	def filter_attribute(self, key, value, inherited=False):
+		"""
+		Returns a clone of the queryset containing only instances whose :class:`Attribute` with the given ``key`` has the given ``value``. Model instances are compared with the values of :class:`ForeignKeyValue`\ s; any other value is compared as JSON with :class:`JSONValue`\ s and :attr:`~Attribute.inline_value`\ s.
+		
+		:param inherited: If ``True`` and the queryset's model is a :class:`TreeEntity` subclass, instances which inherit the value from their nearest ancestor with the ``key`` will match as well. If :data:`USE_ATTRIBUTE_CLOSURE` is ``True``, this uses the :class:`InheritedAttribute` rows; otherwise the instances' ancestors are compared by their MPTT fields in a subquery.
+		
+		JSON values are found through the indexed :attr:`JSONValue.value_hash` and :attr:`Attribute.inline_value_hash` and then compared as serialized by :func:`~philo.models.fields.dump_json`.
+		
+		.. note:: Values saved through the ORM, including raw saves such as fixture loading, are normalized when they are saved, and migration ``0025`` normalizes the values stored before hashes were introduced. Values which are written to the database by other means - for example with :meth:`QuerySet.update` or raw SQL - must be serialized with :func:`~philo.models.fields.dump_json` and hashed with :func:`make_json_hash`, or they won't be found.
+		
+		"""
+		ct = ContentType.objects.get_for_model(self.model)
+		attributes = Attribute.objects.filter(_get_attribute_value_q(value), entity_content_type=ct, key=key)
+		if not inherited or not issubclass(self.model, TreeEntity):
+			return self.filter(pk__in=attributes.values('entity_object_id'))
+		
+		if USE_ATTRIBUTE_CLOSURE:
+			inherited_attributes = InheritedAttribute.objects.filter(entity_content_type=ct, key=key, attribute__in=attributes.values('pk'))
+			return self.filter(pk__in=inherited_attributes.values('entity_object_id'))
+		
+		where, params = _get_inherited_attribute_where(self.model, key, attributes)
+		return self.extra(where=[where], params=params)
+	
+	def iterator(self):
+		if not self._prefetch_attributes:
+			return super(EntityQuerySet, self).iterator()
+		results = list(super(EntityQuerySet, self).iterator())
+		prefetch_attributes(results, self._prefetch_attribute_keys)
+		return iter(results)
+	
+	def _clone(self, klass=None, setup=False, **kwargs):
+		clone = super(EntityQuerySet, self)._clone(klass, setup, **kwargs)
+		clone._prefetch_attributes = self._prefetch_attributes
+		clone._prefetch_attribute_keys = self._prefetch_attribute_keys
+		return clone
+
+
+class EntityManager(models.Manager):
+	"""The default manager for :class:`Entity` subclasses. Returns :class:`EntityQuerySet`\ s."""
+	def get_query_set(self):
+		return EntityQuerySet(self.model, using=self._db)
+	
+	def prefetch_attributes(self, keys=None):
+		"""See :meth:`EntityQuerySet.prefetch_attributes`."""
+		return self.get_query_set().prefetch_attributes(keys)
+	
+	def filter_attribute(self, key, value, inherited=False):
+		"""See :meth:`EntityQuerySet.filter_attribute`."""
+		return self.get_query_set().filter_attribute(key, value, inherited)
+
+
 class EntityOptions(object):
 	def __init__(self, options):
 		if options is not None:
@@ -295,6 +840,11 @@ class EntityBase(models.base.ModelBase):
 		entity_meta = attrs.pop('EntityMeta', None)
 		new = super(EntityBase, cls).__new__(cls, name, bases, attrs)
 		new.add_to_class('_entity_meta', EntityOptions(entity_meta))
+		if not new._meta.abstract:
+			models.signals.post_save.connect(bump_entity_version, sender=new)
+			models.signals.post_delete.connect(bump_entity_version, sender=new)
+			models.signals.post_save.connect(bump_object_version, sender=new)
+			models.signals.post_delete.connect(bump_object_version, sender=new)
 		entity_class_prepared.send(sender=new)
 		return new
 
@@ -303,11 +853,12 @@ class Entity(models.Model):
 	"""An abstract class that simplifies access to related attributes. Most models provided by Philo subclass Entity."""
 	__metaclass__ = EntityBase
 	
+	objects = EntityManager()
 	attribute_set = generic.GenericRelation(Attribute, content_type_field='entity_content_type', object_id_field='entity_object_id')
 	
-	def get_attribute_mapper(self, mapper=AttributeMapper):
+	def get_attribute_mapper(self, mapper=None):
 		"""
-		Returns an :class:`.AttributeMapper` which can be used to retrieve related :class:`Attribute`\ s' values directly.
+		Returns an :class:`.AttributeMapper` which can be used to retrieve related :class:`Attribute`\ s' values directly. Unless another ``mapper`` class is given, this will be a :class:`.CachedAttributeMapper` if :data:`~philo.utils.entities.USE_ATTRIBUTE_CACHE` is ``True``, and an :class:`.AttributeMapper` otherwise.
 
 		Example::
 
@@ -318,6 +869,8 @@ class Entity(models.Model):
 			u'eggs'
 		
 		"""
+		if mapper is None:
+			mapper = USE_ATTRIBUTE_CACHE and CachedAttributeMapper or AttributeMapper
 		return mapper(self)
 	
 	@property
@@ -330,17 +883,158 @@ class Entity(models.Model):
 		abstract = True
 
 
+def make_tree_version_key(model):
+	"""Returns the key of the cache version which tracks changes to the tree of ``model``."""
+	opts = model._meta
+	return 'tree:%s.%s' % (opts.app_label, opts.object_name.lower())
+
+
+def bump_tree_version(sender, **kwargs):
+	"""Connected to the post_save and post_delete signals of every concrete :class:`TreeEntity` subclass. Replaces the model's tree version so that any caches built from the tree structure will be rebuilt."""
+	bump_cache_version(make_tree_version_key(sender))
+
+
+def update_attribute_closure(entity, keys=None):
+	"""
+	Brings the :class:`InheritedAttribute` rows of the :class:`TreeEntity` instance ``entity`` and its descendants up to date for the given ``keys``, or for all keys if ``keys`` is ``None``. The current state is read with three queries; only rows whose resolved :class:`Attribute` has changed are written, and new rows are inserted in bulk.
+	
+	"""
+	ct = ContentType.objects.get_for_model(entity)
+	opts = entity._mptt_meta
+	ancestor_pks = list(entity.get_ancestors().values_list('pk', flat=True))
+	subtree = list(entity.get_descendants(include_self=True).order_by(opts.left_attr).values_list('pk', opts.parent_attr))
+	subtree_pks = [pk for pk, parent_pk in subtree]
+	
+	attributes = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestor_pks + subtree_pks)
+	rows = InheritedAttribute.objects.filter(entity_content_type=ct, entity_object_id__in=subtree_pks)
+	if keys is not None:
+		attributes = attributes.filter(key__in=keys)
+		rows = rows.filter(key__in=keys)
+	
+	declared = {}
+	for attribute_pk, object_id, key in attributes.values_list('pk', 'entity_object_id', 'key'):
+		declared.setdefault(object_id, {})[key] = attribute_pk
+	
+	inherited = {}
+	for pk in ancestor_pks:
+		inherited.update(declared.get(pk, {}))
+	
+	# Parents precede their children in tree order.
+	effective = {}
+	for pk, parent_pk in subtree:
+		resolved = dict(effective.get(parent_pk, inherited))
+		resolved.update(declared.get(pk, {}))
+		effective[pk] = resolved
+	
+	deletes = []
+	updates = {}
+	for row_pk, object_id, key, attribute_pk in rows.values_list('pk', 'entity_object_id', 'key', 'attribute'):
+		resolved = effective[object_id].pop(key, None)
+		if resolved is None:
+			deletes.append(row_pk)
+		elif resolved != attribute_pk:
+			updates.setdefault(resolved, []).append(row_pk)
+	
+	if deletes:
+		InheritedAttribute.objects.filter(pk__in=deletes).delete()
+	for attribute_pk, row_pks in updates.items():
+		InheritedAttribute.objects.filter(pk__in=row_pks).update(attribute=attribute_pk)
+	inserts = []
+	for object_id, resolved in effective.items():
+		for key, attribute_pk in resolved.items():
+			inserts.append((ct.pk, object_id, key, attribute_pk))
+	if inserts:
+		_insert_many(InheritedAttribute, ('entity_content_type', 'entity_object_id', 'key', 'attribute'), inserts)
+
+
+def rebuild_attribute_closure(model):
+	"""Brings the :class:`InheritedAttribute` rows for every instance of the :class:`TreeEntity` subclass ``model`` up to date. This should be run once after :data:`USE_ATTRIBUTE_CLOSURE` is turned on."""
+	for root in model._tree_manager.root_nodes():
+		update_attribute_closure(root)
+
+
+def _update_closure_for(content_type_id, object_id, key):
+	model = ContentType.objects.get_for_id(content_type_id).model_class()
+	if model is None or not issubclass(model, TreeEntity):
+		return
+	try:
+		entity = model._default_manager.get(pk=object_id)
+	except model.DoesNotExist:
+		return
+	update_attribute_closure(entity, [key])
+
+
+def remember_closure_attribute(sender, instance, **kwargs):
+	"""Connected to the pre_save signal of :class:`Attribute`. Remembers which entity and key an existing :class:`Attribute` belonged to, so that its previous entity's :class:`InheritedAttribute` rows can be updated if either changes."""
+	instance._closure_previous = None
+	if USE_ATTRIBUTE_CLOSURE and instance.pk is not None:
+		previous = list(Attribute.objects.filter(pk=instance.pk).values_list('entity_content_type', 'entity_object_id', 'key'))
+		if previous:
+			instance._closure_previous = previous[0]
+
+
+def update_closure_for_attribute(sender, instance, **kwargs):
+	"""Connected to the post_save and post_delete signals of :class:`Attribute`. Updates the :class:`InheritedAttribute` rows of the attribute's entity and its descendants for the attribute's key."""
+	if not USE_ATTRIBUTE_CLOSURE:
+		return
+	current = (instance.entity_content_type_id, instance.entity_object_id, instance.key)
+	_update_closure_for(*current)
+	previous = getattr(instance, '_closure_previous', None)
+	if previous is not None and tuple(previous) != current:
+		_update_closure_for(*previous)
+
+
+models.signals.pre_save.connect(remember_closure_attribute, sender=Attribute)
+models.signals.post_save.connect(update_closure_for_attribute, sender=Attribute)
+models.signals.post_delete.connect(update_closure_for_attribute, sender=Attribute)
+
+
+def remember_closure_parent(sender, instance, **kwargs):
+	"""Connected to the pre_save signal of every concrete :class:`TreeEntity` subclass. Remembers the parent an existing instance had before it was saved, so that :func:`update_closure_for_entity` can tell whether it has moved."""
+	instance._closure_previous_parent = None
+	if USE_ATTRIBUTE_CLOSURE and instance.pk is not None:
+		previous = list(sender._default_manager.filter(pk=instance.pk).values_list('parent', flat=True))
+		if previous:
+			instance._closure_previous_parent = previous
+
+
+def update_closure_for_entity(sender, instance, created=False, **kwargs):
+	"""Connected to the post_save signal of every concrete :class:`TreeEntity` subclass. Updates the :class:`InheritedAttribute` rows of the instance and its descendants if it was created or its parent changed."""
+	if not USE_ATTRIBUTE_CLOSURE:
+		return
+	previous = getattr(instance, '_closure_previous_parent', None)
+	if created or previous is None or previous[0] != instance.parent_id:
+		update_attribute_closure(instance)
+
+
+def delete_closure_for_entity(sender, instance, **kwargs):
+	"""Connected to the post_delete signal of every concrete :class:`TreeEntity` subclass. Deletes the instance's :class:`InheritedAttribute` rows."""
+	if USE_ATTRIBUTE_CLOSURE:
+		InheritedAttribute.objects.filter(entity_content_type=ContentType.objects.get_for_model(sender), entity_object_id=instance.pk).delete()
+
+
 class TreeEntityBase(MPTTModelBase, EntityBase):
 	def __new__(meta, name, bases, attrs):
 		attrs['_mptt_meta'] = MPTTOptions(attrs.pop('MPTTMeta', None))
 		cls = EntityBase.__new__(meta, name, bases, attrs)
 		
+		if not cls._meta.abstract:
+			models.signals.post_save.connect(bump_tree_version, sender=cls)
+			models.signals.post_delete.connect(bump_tree_version, sender=cls)
+			models.signals.pre_save.connect(remember_closure_parent, sender=cls)
+			models.signals.post_save.connect(update_closure_for_entity, sender=cls)
+			models.signals.post_delete.connect(delete_closure_for_entity, sender=cls)
+		
 		return meta.register(cls)
 
 
-class TreeEntityManager(models.Manager):
+class TreeEntityManager(EntityManager):
 	use_for_related_fields = True
 	
+	def get_tree_version(self):
+		"""Returns an opaque marker which changes whenever an instance of the manager's model is saved, moved, or deleted. See :func:`~philo.utils.get_cache_version`."""
+		return get_cache_version(make_tree_version_key(self.model))
+	
 	def get_with_path(self, path, root=None, absolute_result=True, pathsep='/', field='pk'):
 		"""
 		If ``absolute_result`` is ``True``, returns the object at ``path`` (starting at ``root``) or raises an :class:`~django.core.exceptions.ObjectDoesNotExist` exception. Otherwise, returns a tuple containing the deepest object found along ``path`` (or ``root`` if no deeper object is found) and the remainder of the path after that object as a string (or None if there is no remaining path).
@@ -484,9 +1178,16 @@ class TreeEntity(Entity, MPTTModel):
 		return pathsep.join([getattr(parent, field, '?') for parent in qs])
 	path = property(get_path)
 	
+	def move_to(self, target, position='first-child'):
+		"""Moves the instance within the tree as :meth:`MPTTModel.move_to` does and invalidates the tree version and updates the :class:`InheritedAttribute` rows of the moved subtree, since moves are not guaranteed to go through :meth:`save`."""
+		super(TreeEntity, self).move_to(target, position)
+		bump_tree_version(self.__class__)
+		if USE_ATTRIBUTE_CLOSURE:
+			update_attribute_closure(self)
+	
 	def get_attribute_mapper(self, mapper=None):
 		"""
-		Returns a :class:`.TreeAttributeMapper` or :class:`.AttributeMapper` which can be used to retrieve related :class:`Attribute`\ s' values directly. If an :class:`Attribute` with a given key is not related to the :class:`Entity`, then the mapper will check the parent's attributes.
+		Returns a :class:`.TreeAttributeMapper` or :class:`.AttributeMapper` which can be used to retrieve related :class:`Attribute`\ s' values directly. If an :class:`Attribute` with a given key is not related to the :class:`Entity`, then the mapper will check the parent's attributes. If :data:`USE_ATTRIBUTE_CLOSURE` is ``True``, a :class:`.ClosureAttributeMapper` is returned instead, which reads the already-resolved :class:`InheritedAttribute` rows.
 
 		Example::
 
@@ -500,10 +1201,10 @@ class TreeEntity(Entity, MPTTModel):
 		
 		"""
 		if mapper is None:
-			if self.parent:
+			if USE_ATTRIBUTE_CLOSURE:
+				mapper = ClosureAttributeMapper
+			elif self.parent_id is not None:
 				mapper = TreeAttributeMapper
-			else:
-				mapper = AttributeMapper
 		return super(TreeEntity, self).get_attribute_mapper(mapper)
 	
 	def __unicode__(self):
@@ -513,19 +1214,123 @@ class TreeEntity(Entity, MPTTModel):
 		abstract = True
 
 
+def make_path_hash(path):
+	"""Returns the hash which :class:`SlugTreeEntity` stores in :attr:`~SlugTreeEntity.full_path_hash` for the given ``path``."""
+	return sha1(smart_str(path)).hexdigest()
+
+
 class SlugTreeEntityManager(TreeEntityManager):
 	def get_with_path(self, path, root=None, absolute_result=True, pathsep='/', field='slug'):
-		return super(SlugTreeEntityManager, self).get_with_path(path, root, absolute_result, pathsep, field)
+		"""
+		Behaves like :meth:`TreeEntityManager.get_with_path`. However, if ``field`` is ``slug``, the lookup uses the indexed :attr:`~SlugTreeEntity.full_path_hash` instead of joining across ancestors, so it is not limited by the depth of the tree. An absolute result will be fetched with a single equality lookup; otherwise, every prefix of ``path`` is looked up in a single ``IN`` query and the deepest match wins.
+		
+		.. note:: If ``root`` is provided, its :attr:`~SlugTreeEntity.full_path` is expected to be current.
+		
+		"""
+		if field != 'slug':
+			return super(SlugTreeEntityManager, self).get_with_path(path, root, absolute_result, pathsep, field)
+		
+		segments = [segment for segment in path.split(pathsep) if segment]
+		
+		# Special-case a lack of segments. No queries necessary.
+		if not segments:
+			if root is not None:
+				if absolute_result:
+					return root
+				return root, None
+			else:
+				raise self.model.DoesNotExist('%s matching query does not exist.' % self.model._meta.object_name)
+		
+		if root is not None:
+			prefix = [root.full_path]
+		else:
+			prefix = []
+		
+		if absolute_result:
+			return self.get(full_path_hash=make_path_hash('/'.join(prefix + segments)))
+		
+		depths = dict([(make_path_hash('/'.join(prefix + segments[:depth])), depth) for depth in xrange(1, len(segments) + 1)])
+		
+		deepest_found = None
+		deepest_level = 0
+		for obj in self.filter(full_path_hash__in=depths.keys()):
+			depth = depths[obj.full_path_hash]
+			if depth > deepest_level:
+				deepest_found, deepest_level = obj, depth
+		
+		if deepest_found is None:
+			if root is not None:
+				return root, pathsep.join(segments)
+			raise self.model.DoesNotExist('%s matching query does not exist.' % self.model._meta.object_name)
+		
+		return deepest_found, pathsep.join(segments[deepest_level:]) or None
 
 
 class SlugTreeEntity(TreeEntity):
 	objects = SlugTreeEntityManager()
 	slug = models.SlugField(max_length=255)
+	#: A denormalized copy of the instance's full path, which is kept up to date by :meth:`save` and :meth:`move_to`.
+	full_path = models.TextField(editable=False, blank=True)
+	#: An indexed hash of :attr:`full_path` which is used by :meth:`SlugTreeEntityManager.get_with_path` for lookups.
+	full_path_hash = models.CharField(max_length=40, editable=False, blank=True, db_index=True)
 	
 	def get_path(self, root=None, pathsep='/', field='slug'):
-		return super(SlugTreeEntity, self).get_path(root, pathsep, field)
+		"""If ``field`` is ``slug``, the path will be built from :attr:`full_path` without any queries."""
+		if field != 'slug' or not self.full_path:
+			return super(SlugTreeEntity, self).get_path(root, pathsep, field)
+		
+		if root == self:
+			return ''
+		
+		segments = self.full_path.split('/')
+		
+		if root is not None:
+			if not self.is_descendant_of(root):
+				raise AncestorDoesNotExist(root)
+			segments = segments[root.get_level() + 1:]
+		
+		return pathsep.join(segments)
 	path = property(get_path)
 	
+	def _set_full_path(self):
+		if self.parent_id is None:
+			full_path = self.slug
+		else:
+			full_path = '%s/%s' % (self._default_manager.filter(pk=self.parent_id).values_list('full_path', flat=True)[0], self.slug)
+		self.full_path = full_path
+		self.full_path_hash = make_path_hash(full_path)
+	
+	def _update_descendant_paths(self):
+		manager = self._default_manager
+		paths = {self.pk: self.full_path}
+		
+		# Descendants are ordered by their left value, so parents are always updated before their children.
+		for pk, parent_id, slug in self.get_descendants().values_list('pk', 'parent', 'slug'):
+			if parent_id not in paths:
+				# Only possible during raw saves, before the parent has been loaded. The parent's own save will update this row.
+				continue
+			full_path = paths[pk] = '%s/%s' % (paths[parent_id], slug)
+			manager.filter(pk=pk).update(full_path=full_path, full_path_hash=make_path_hash(full_path))
+		
+		# Make sure that caches built while the descendants were being updated are discarded.
+		bump_tree_version(self.__class__)
+	
+	def save(self, *args, **kwargs):
+		"""Updates :attr:`full_path` before saving and, if it has changed, the :attr:`full_path` of every descendant after saving."""
+		old_path = self.full_path
+		self._set_full_path()
+		super(SlugTreeEntity, self).save(*args, **kwargs)
+		if old_path and old_path != self.full_path:
+			self._update_descendant_paths()
+	
+	def move_to(self, target, position='first-child'):
+		old_path = self.full_path
+		super(SlugTreeEntity, self).move_to(target, position)
+		self._set_full_path()
+		if old_path != self.full_path:
+			self._default_manager.filter(pk=self.pk).update(full_path=self.full_path, full_path_hash=self.full_path_hash)
+			self._update_descendant_paths()
+	
 	def clean(self):
 		if self.parent is None:
 			try:
@@ -537,4 +1342,18 @@ class SlugTreeEntity(TreeEntity):
 	
 	class Meta:
 		unique_together = ('parent', 'slug')
-		abstract = True
\ No newline at end of file
+		abstract = True
+
+
+def update_raw_full_path(sender, instance, raw=False, **kwargs):
+	"""Connected to the post_save signal. Raw saves, such as those made by ``loaddata``, bypass :meth:`SlugTreeEntity.save`, so this sets the :attr:`~SlugTreeEntity.full_path` of a raw-saved :class:`SlugTreeEntity` from the ancestors which have already been loaded and rewrites the paths of any descendants which were loaded before it. Once every row has been loaded, all paths are correct, whatever order the rows were loaded in."""
+	if not raw or not isinstance(instance, SlugTreeEntity):
+		return
+	segments = list(instance.get_ancestors().values_list('slug', flat=True)) + [instance.slug]
+	instance.full_path = '/'.join(segments)
+	instance.full_path_hash = make_path_hash(instance.full_path)
+	instance._default_manager.filter(pk=instance.pk).update(full_path=instance.full_path, full_path_hash=instance.full_path_hash)
+	instance._update_descendant_paths()
+
+
+models.signals.post_save.connect(update_raw_full_path)
\ No newline at end of file
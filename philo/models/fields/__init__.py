@@ -18,6 +18,11 @@ class TemplateField(models.TextField):
 		self.validators.append(TemplateValidator(allow, disallow, secure))
 
 
+def dump_json(value):
+	"""Serializes ``value`` as JSON with sorted keys and fixed separators, so that equal values are always stored as the same string and can be compared in the database."""
+	return json.dumps(value, sort_keys=True, separators=(', ', ': '))
+
+
 class JSONDescriptor(object):
 	def __init__(self, field):
 		self.field = field
@@ -34,15 +39,15 @@ class JSONDescriptor(object):
 	
 	def __set__(self, instance, value):
 		instance.__dict__[self.field.name] = value
-		setattr(instance, self.field.attname, json.dumps(value))
+		setattr(instance, self.field.attname, dump_json(value))
 	
 	def __delete__(self, instance):
 		del(instance.__dict__[self.field.name])
-		setattr(instance, self.field.attname, json.dumps(None))
+		setattr(instance, self.field.attname, dump_json(None))
 
 
 class JSONField(models.TextField):
-	"""A :class:`TextField` which stores its value on the model instance as a python object and stores its value in the database as JSON. Validated with :func:`.json_validator`."""
+	"""A :class:`TextField` which stores its value on the model instance as a python object and stores its value in the database as JSON, serialized with :func:`dump_json`. Validated with :func:`.json_validator`."""
 	default_validators = [json_validator]
 	
 	def get_attname(self):
@@ -3,11 +3,11 @@ from itertools import tee
 
 from django import forms
 from django.core.exceptions import FieldError
-from django.db import models
+from django.db import models, transaction
 from django.db.models.fields import NOT_PROVIDED
 from django.utils.text import capfirst
 
-from philo.models import ManyToManyValue, JSONValue, ForeignKeyValue, Attribute, Entity
+from philo.models import ManyToManyValue, JSONValue, ForeignKeyValue, Entity, set_attribute_values
 from philo.signals import entity_class_prepared
 
 
@@ -144,24 +144,26 @@ class AttributeFieldDescriptor(object):
 
 
 def process_attribute_fields(sender, instance, created, **kwargs):
-	"""This function is attached to each :class:`Entity` subclass's post_save signal. Any :class:`Attribute`\ s managed by :class:`AttributeProxyField`\ s which have been removed will be deleted, and any new attributes will be created."""
+	"""This function is attached to each :class:`Entity` subclass's post_save signal. Any :class:`Attribute`\ s managed by :class:`AttributeProxyField`\ s which have been removed will be deleted, and any new attributes will be created. The :class:`Attribute`\ s are written in bulk with :func:`.set_attribute_values`, inside a single transaction."""
 	if ATTRIBUTE_REGISTRY in instance.__dict__:
 		registry = instance.__dict__[ATTRIBUTE_REGISTRY]
-		instance.attribute_set.filter(key__in=[field.attribute_key for field in registry['removed']]).delete()
-		
-		for field in registry['added']:
-			# TODO: Should this perhaps just use instance.attributes[field.attribute_key] = getattr(instance, field.name, None)?
-			# (Would eliminate the need for field.value_class.)
-			try:
-				attribute = instance.attribute_set.get(key=field.attribute_key)
-			except Attribute.DoesNotExist:
-				attribute = Attribute()
-				attribute.entity = instance
-				attribute.key = field.attribute_key
-			attribute.set_value(value=getattr(instance, field.name, None), value_class=field.value_class)
+		using = kwargs.get('using') or instance._state.db
+		if transaction.is_managed(using=using):
+			_save_attribute_fields(instance, registry)
+		else:
+			transaction.commit_on_success(using=using)(_save_attribute_fields)(instance, registry)
 		del instance.__dict__[ATTRIBUTE_REGISTRY]
 
 
+def _save_attribute_fields(instance, registry):
+	if registry['removed']:
+		instance.attribute_set.filter(key__in=[field.attribute_key for field in registry['removed']]).delete()
+	
+	# TODO: Should this perhaps just use instance.attributes[field.attribute_key] = getattr(instance, field.name, None)?
+	# (Would eliminate the need for field.value_class.)
+	set_attribute_values(instance, [(field.attribute_key, getattr(instance, field.name, None), field.value_class) for field in registry['added']])
+
+
 class JSONAttribute(AttributeProxyField):
 	"""
 	Handles an :class:`.Attribute` with a :class:`.JSONValue`.
@@ -1,29 +1,243 @@
+from calendar import timegm
 from inspect import getargspec
 import mimetypes
 from os.path import basename
+from time import mktime
+import uuid
+from weakref import WeakKeyDictionary
 
+from django.conf import settings
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site, RequestSite
 from django.core.exceptions import ValidationError
 from django.core.servers.basehttp import FileWrapper
-from django.core.urlresolvers import resolve, clear_url_caches, reverse, NoReverseMatch
+from django.core.urlresolvers import RegexURLResolver, reverse, NoReverseMatch
 from django.db import models
 from django.http import HttpResponse, HttpResponseServerError, HttpResponseRedirect, Http404
-from django.utils.encoding import smart_str
+from django.utils.encoding import smart_str, iri_to_uri
+from django.utils.http import parse_http_date_safe, quote_etag
+from django.views.decorators.http import condition
 
-from philo.exceptions import MIDDLEWARE_NOT_CONFIGURED, ViewCanNotProvideSubpath, ViewDoesNotProvideSubpaths
-from philo.models.base import SlugTreeEntity, Entity, register_value_model
+from philo.exceptions import MIDDLEWARE_NOT_CONFIGURED, ViewCanNotProvideSubpath, ViewDoesNotProvideSubpaths, AncestorDoesNotExist
+from philo.models.base import SlugTreeEntity, SlugTreeEntityManager, Entity, register_value_model, make_tree_version_key
 from philo.models.fields import JSONField
-from philo.utils import ContentTypeSubclassLimiter
+from philo.utils import ContentTypeSubclassLimiter, get_cache_versions, check_cache_versions, make_object_version_key, make_model_version_key
 from philo.utils.entities import LazyPassthroughAttributeMapper
 from philo.signals import view_about_to_render, view_finished_rendering
 
 
-__all__ = ('Node', 'View', 'MultiView', 'Redirect', 'File')
+__all__ = ('NodeManager', 'Node', 'View', 'MultiView', 'Redirect', 'File')
 
 
 _view_content_type_limiter = ContentTypeSubclassLimiter(None)
+_argspecs = WeakKeyDictionary()
+#: Whether :meth:`Node.construct_url` should look up paths with :meth:`NodeManager.get_cached_path`. This is controlled by the ``PHILO_NODE_URL_CACHE`` setting. Default: ``False``.
+USE_URL_CACHE = getattr(settings, 'PHILO_NODE_URL_CACHE', False)
+#: The header used to have the front-end server send :class:`File`\ s, if any. ``'X-Accel-Redirect'`` (nginx) will be set to the file's name prefixed with :data:`SENDFILE_URL_PREFIX`; any other header (for example ``'X-Sendfile'`` for apache and lighttpd) will be set to the file's absolute path. This is controlled by the ``PHILO_FILE_SENDFILE_HEADER`` setting. Default: ``None``, which means files are streamed by django.
+SENDFILE_HEADER = getattr(settings, 'PHILO_FILE_SENDFILE_HEADER', None)
+#: The url prefix of the internal location which serves :setting:`MEDIA_ROOT` when :data:`SENDFILE_HEADER` is ``'X-Accel-Redirect'``. This is controlled by the ``PHILO_FILE_SENDFILE_URL_PREFIX`` setting. Default: :setting:`MEDIA_URL`.
+SENDFILE_URL_PREFIX = getattr(settings, 'PHILO_FILE_SENDFILE_URL_PREFIX', settings.MEDIA_URL)
+
+
+def parse_byte_ranges(header, size):
+	"""
+	Parses the value of an HTTP ``Range`` header for a resource which is ``size`` bytes long.
+	
+	:returns: ``None`` if the header is missing or malformed, in which case it should be ignored; otherwise a list of inclusive ``(first, last)`` byte positions for each satisfiable range, which will be empty if no range can be satisfied.
+	
+	"""
+	if not header or not header.startswith('bytes='):
+		return None
+	ranges = []
+	for spec in header[len('bytes='):].split(','):
+		spec = spec.strip()
+		if not spec:
+			continue
+		if '-' not in spec:
+			return None
+		first, last = [bit.strip() for bit in spec.split('-', 1)]
+		try:
+			if first:
+				first = int(first)
+				if last:
+					last = int(last)
+					if last < first:
+						return None
+				else:
+					last = size - 1
+			else:
+				# A suffix range - the final bytes of the resource.
+				if not last:
+					return None
+				suffix = int(last)
+				if suffix == 0:
+					continue
+				first, last = max(size - suffix, 0), size - 1
+		except ValueError:
+			return None
+		if first >= size:
+			continue
+		ranges.append((first, min(last, size - 1)))
+	return ranges
+
+
+def _iter_file_range(f, first, last, block_size=8192):
+	f.seek(first)
+	remaining = last - first + 1
+	while remaining > 0:
+		data = f.read(min(block_size, remaining))
+		if not data:
+			break
+		remaining -= len(data)
+		yield data
+
+
+def get_argspec(view):
+	"""Returns the result of :func:`inspect.getargspec` for ``view``. Results are cached for as long as ``view`` exists, since view callables are generally reused by the compiled resolvers of :class:`View`\ s."""
+	try:
+		return _argspecs[view]
+	except KeyError:
+		argspec = _argspecs[view] = getargspec(view)
+		return argspec
+
+
+class NodeManager(SlugTreeEntityManager):
+	"""
+	In addition to the features of :class:`.TreeEntityManager`, the :class:`NodeManager` maintains a per-process routing table, which maps the full path of every :class:`Node` to the data needed to instantiate it and the pk of every :class:`Node` to its full path. The table is built with a single query and is checked against the same version markers as other caches of entity data: the tree version, which changes whenever a :class:`Node` is saved, moved, or deleted, and the :class:`Node` model's version (see :func:`~philo.utils.make_model_version_key`). It is rebuilt as soon as either changes in any process sharing the same cache backend.
+	
+	.. note:: The table relies on django's cache framework to notice changes made by other processes, so a cache backend shared between processes is required if more than one process is serving the site.
+	
+	"""
+	_routing_tables = {}
+	
+	def get_version_keys(self):
+		"""Returns the keys of the version markers which the routing table is checked against."""
+		return [make_tree_version_key(self.model), make_model_version_key(ContentType.objects.get_for_model(self.model).pk)]
+	
+	def get_routing_table(self):
+		"""Returns a (``paths``, ``rows``) tuple, where ``paths`` maps each :class:`Node`'s pk to its full path and ``rows`` maps each full path to the field values of the :class:`Node` at that path. The table will be built if it does not exist or if any of its version markers have changed."""
+		cached = self.__class__._routing_tables.get(self.db)
+		if cached is None or not check_cache_versions(cached[0]):
+			# The markers are read before the table is built, so that changes
+			# made while it is being built cause it to be rebuilt again.
+			versions = get_cache_versions(self.get_version_keys())
+			cached = (versions, self._build_routing_table())
+			self.__class__._routing_tables[self.db] = cached
+		return cached[1]
+	
+	def get_cached_path(self, pk, root_pk=None):
+		"""
+		Returns the path of the :class:`Node` with the given ``pk`` relative to the :class:`Node` with the given ``root_pk``, as :meth:`~.TreeEntity.get_path` would, but using the routing table.
+		
+		:raises KeyError: if either pk is not in the routing table.
+		:raises philo.exceptions.AncestorDoesNotExist: if the root is not an ancestor of the :class:`Node`.
+		
+		"""
+		paths = self.get_routing_table()[0]
+		full_path = paths[pk]
+		
+		if root_pk is None:
+			return full_path
+		
+		if root_pk == pk:
+			return ''
+		
+		root_path = paths[root_pk]
+		if not full_path.startswith(root_path + '/'):
+			raise AncestorDoesNotExist(root_pk)
+		return full_path[len(root_path) + 1:]
+	
+	def urls_for(self, nodes, root=None):
+		"""
+		Returns a dictionary mapping the pk of each of the given :class:`Node`\ s to its url, as :meth:`Node.get_absolute_url` would construct it. The urls are assembled from each :class:`Node`'s :attr:`~.SlugTreeEntity.full_path`, so no ancestors need to be fetched: if ``nodes`` is a queryset, a single query is made; otherwise, no queries are made. :class:`Node`\ s which are not descendants of ``root`` are left out.
+		
+		:param nodes: A queryset or an iterable of :class:`Node` instances.
+		:param root: The :class:`Node` which the urls will be relative to. Defaults to the root node of the current :class:`Site`.
+		:returns: A dictionary mapping pks to urls.
+		
+		"""
+		root_url = reverse('philo-root')
+		
+		if root is None:
+			try:
+				current_site = Site.objects.get_current()
+			except Site.DoesNotExist:
+				current_site = None
+			root = getattr(current_site, 'root_node', None)
+		
+		if isinstance(nodes, models.query.QuerySet):
+			paths = nodes.values_list('pk', 'full_path')
+		else:
+			paths = [(node.pk, node.full_path) for node in nodes]
+		
+		if root is None:
+			prefix = ''
+		else:
+			prefix = root.full_path + '/'
+		
+		urls = {}
+		for pk, full_path in paths:
+			if root is not None and pk == root.pk:
+				path = ''
+			elif full_path.startswith(prefix):
+				path = full_path[len(prefix):]
+			else:
+				continue
+			urls[pk] = '%s%s' % (root_url, path)
+		return urls
+	
+	def _build_routing_table(self):
+		attnames = [f.attname for f in self.model._meta.fields]
+		pk_index = attnames.index(self.model._meta.pk.attname)
+		path_index = attnames.index('full_path')
+		
+		paths = {}
+		rows = {}
+		
+		for row in self.values_list(*attnames):
+			paths[row[pk_index]] = row[path_index]
+			rows[row[path_index]] = row
+		
+		return paths, rows
+	
+	def clear_tables(self):
+		"""Clears the routing table for the manager's database in the current process."""
+		self.__class__._routing_tables.pop(self.db, None)
+	
+	def get_with_routing_table(self, path, root=None, pathsep='/'):
+		"""
+		Behaves like :meth:`~.TreeEntityManager.get_with_path` with ``absolute_result`` set to ``False``, but resolves ``path`` against the routing table, so no queries are necessary unless the table needs to be rebuilt.
+		
+		:param path: The path of the object
+		:param root: The object which will be considered the root of the search
+		:param pathsep: The path separator used in ``path``
+		:returns: An (instance, remaining_path) tuple.
+		:raises django.core.exceptions.ObjectDoesNotExist: if no object can be found matching the input parameters.
+		
+		"""
+		segments = [segment for segment in path.split(pathsep) if segment]
+		paths, rows = self.get_routing_table()
+		
+		if root is not None:
+			prefix = paths.get(root.pk)
+			if prefix is None:
+				return root, pathsep.join(segments) or None
+			prefix = [prefix]
+		else:
+			prefix = []
+		
+		for depth in xrange(len(segments), 0, -1):
+			row = rows.get('/'.join(prefix + segments[:depth]))
+			if row is not None:
+				obj = self.model(*row)
+				obj._state.db = self.db
+				obj._state.adding = False
+				return obj, pathsep.join(segments[depth:]) or None
+		
+		if root is not None:
+			return root, pathsep.join(segments) or None
+		raise self.model.DoesNotExist('%s matching query does not exist.' % self.model._meta.object_name)
 
 
 class Node(SlugTreeEntity):
@@ -31,6 +245,8 @@ class Node(SlugTreeEntity):
 	:class:`Node`\ s are the basic building blocks of a website using Philo. They define the URL hierarchy and connect each URL to a :class:`View` subclass instance which is used to generate an HttpResponse.
 	
 	"""
+	#: A :class:`NodeManager` instance.
+	objects = NodeManager()
 	view_content_type = models.ForeignKey(ContentType, related_name='node_view_set', limit_choices_to=_view_content_type_limiter)
 	view_object_id = models.PositiveIntegerField()
 	#: :class:`GenericForeignKey` to a non-abstract subclass of :class:`View`
@@ -65,6 +281,8 @@ class Node(SlugTreeEntity):
 		
 		Node urls will not contain a trailing slash unless a subpath is provided which ends with a trailing slash. Subpaths are expected to begin with a slash, as if returned by :func:`django.core.urlresolvers.reverse`.
 		
+		If :data:`USE_URL_CACHE` is ``True``, the path of the node will be taken from :meth:`NodeManager.get_cached_path`, so no queries are needed to construct the url.
+		
 		:meth:`construct_url` may raise the following exceptions:
 		
 		- :class:`NoReverseMatch` if "philo-root" is not reversable -- for example, if :mod:`philo.urls` is not included anywhere in your urlpatterns.
@@ -93,8 +311,16 @@ class Node(SlugTreeEntity):
 			else:
 				current_site = None
 		
-		root = getattr(current_site, 'root_node', None)
-		path = self.get_path(root=root)
+		path = None
+		if USE_URL_CACHE and self.pk is not None:
+			try:
+				path = Node.objects.get_cached_path(self.pk, getattr(current_site, 'root_node_id', None))
+			except KeyError:
+				pass
+		
+		if path is None:
+			root = getattr(current_site, 'root_node', None)
+			path = self.get_path(root=root)
 		
 		if current_site and with_domain:
 			domain = "http%s://%s" % (secure and "s" or "", current_site.domain)
@@ -124,6 +350,10 @@ class View(Entity):
 	
 	#: Property or attribute which defines whether this :class:`View` can handle subpaths. Default: ``False``
 	accepts_subpath = False
+	#: Property or attribute which defines whether responses rendered by this :class:`View` may be stored in the response cache. See :func:`philo.views.cache_node_response`. Default: ``False``
+	cache_responses = False
+	
+	_resolvers = {}
 	
 	def handles_subpath(self, subpath):
 		"""Returns True if the :class:`View` handles the given subpath, and False otherwise."""
@@ -160,7 +390,7 @@ class View(Entity):
 			kwargs = obj_kwargs
 		
 		try:
-			subpath = reverse(view_name, urlconf=self, args=args or [], kwargs=kwargs or {})
+			subpath = iri_to_uri(u'/%s' % self.get_resolver().reverse(view_name, *(args or []), **(kwargs or {})))
 		except NoReverseMatch, e:
 			raise ViewCanNotProvideSubpath(e.message)
 		
@@ -168,6 +398,51 @@ class View(Entity):
 			return node.construct_url(subpath)
 		return subpath
 	
+	def get_resolver_version_keys(self):
+		"""Returns a list of version keys (see :func:`~philo.utils.make_object_version_key`) for the objects which the :class:`View`'s urlpatterns are built from. A compiled resolver is discarded as soon as any of these keys' markers change. By default, this only includes the :class:`View` itself; subclasses whose urlpatterns depend on other objects should add their keys."""
+		return [make_object_version_key(ContentType.objects.get_for_model(self).pk, self.pk)]
+	
+	def get_resolver(self):
+		"""
+		Returns a :class:`RegexURLResolver` for the :class:`View`'s urlpatterns, which is used to resolve and reverse subpaths. The urlpatterns are only built when the resolver is compiled, and compiled resolvers are shared in the current process by every instance with the same content type and pk until any of the markers for :meth:`get_resolver_version_keys` change. Django's global url caches are never touched.
+		
+		"""
+		if not hasattr(self, '_resolver'):
+			if self.pk is None:
+				self._resolver = RegexURLResolver(r'^/', self.urlpatterns)
+			else:
+				key = (ContentType.objects.get_for_model(self).pk, self.pk)
+				cached = View._resolvers.get(key)
+				if cached is None or not check_cache_versions(cached[0]):
+					# The versions are read before the urlpatterns are built, so
+					# that the resolver is stale if they change in the meantime.
+					versions = get_cache_versions(self.get_resolver_version_keys())
+					cached = (versions, RegexURLResolver(r'^/', self.urlpatterns))
+					View._resolvers[key] = cached
+				self._resolver = cached[1]
+		return self._resolver
+	
+	def get_response_cache_tags(self, request):
+		"""
+		Returns a list of version keys (see :func:`~philo.utils.make_object_version_key`) for the objects which contributed to the response rendered for ``request``. A cached response will be discarded as soon as any of these keys' markers change. By default, this includes the :class:`View`, the request's :class:`Node` and its ancestors (whose attributes may be inherited), and the node tree's version, which changes whenever any node is saved or moved.
+		
+		"""
+		tags = [make_object_version_key(ContentType.objects.get_for_model(self).pk, self.pk)]
+		node = getattr(request, 'node', None)
+		if node:
+			node_content_type_id = ContentType.objects.get_for_model(Node).pk
+			tags.append(make_tree_version_key(Node))
+			tags.extend([make_object_version_key(node_content_type_id, pk) for pk in node.get_ancestors(include_self=True).values_list('pk', flat=True)])
+		return tags
+	
+	def get_etag(self, request, extra_context=None):
+		"""Returns an ETag for the response the :class:`View` would render for ``request``, or ``None`` if there is no ETag which is cheaper to compute than the response itself. See :meth:`render_to_response`. Default: ``None``"""
+		return None
+	
+	def get_last_modified(self, request, extra_context=None):
+		"""Returns a :class:`datetime` marking the last modification of the response the :class:`View` would render for ``request``, or ``None`` if it is unknown. See :meth:`render_to_response`. Default: ``None``"""
+		return None
+	
 	def get_reverse_params(self, obj):
 		"""
 		This method is not implemented on the base class. It should return a (``view_name``, ``args``, ``kwargs``) tuple suitable for reversing a url for the given ``obj`` using ``self`` as the urlconf. If a reversal will not be possible, this method should raise :class:`~philo.exceptions.ViewCanNotProvideSubpath`.
@@ -187,6 +462,8 @@ class View(Entity):
 		Renders the :class:`View` as an :class:`HttpResponse`. This will raise :const:`~philo.exceptions.MIDDLEWARE_NOT_CONFIGURED` if the `request` doesn't have an attached :class:`Node`. This can happen if the :class:`~philo.middleware.RequestNodeMiddleware` is not in :setting:`settings.MIDDLEWARE_CLASSES` or if it is not functioning correctly.
 		
 		:meth:`render_to_response` will send the :data:`~philo.signals.view_about_to_render` signal, then call :meth:`actually_render_to_response`, and finally send the :data:`~philo.signals.view_finished_rendering` signal before returning the ``response``.
+		
+		If the :class:`View` is the view of the request's :class:`Node`, the results of :meth:`get_etag` and :meth:`get_last_modified` are used to answer conditional requests: if the client's copy is current, an :class:`HttpResponseNotModified` is returned without calling :meth:`actually_render_to_response`. Views rendered on behalf of other views - for example, :class:`Page`\ s used by a :class:`MultiView` - are always rendered, since their content depends on the calling view.
 
 		"""
 		if not hasattr(request, 'node'):
@@ -194,7 +471,11 @@ class View(Entity):
 		
 		extra_context = extra_context or {}
 		view_about_to_render.send(sender=self, request=request, extra_context=extra_context)
-		response = self.actually_render_to_response(request, extra_context)
+		if request.node and request.node.view == self:
+			render = condition(etag_func=self.get_etag, last_modified_func=self.get_last_modified)(self.actually_render_to_response)
+		else:
+			render = self.actually_render_to_response
+		response = render(request, extra_context)
 		view_finished_rendering.send(sender=self, response=response)
 		return response
 	
@@ -226,20 +507,32 @@ class MultiView(View):
 		if not super(MultiView, self).handles_subpath(subpath):
 			return False
 		try:
-			resolve(subpath, urlconf=self)
+			self.resolve_subpath(subpath)
 		except Http404:
 			return False
 		return True
 	
+	def resolve_subpath(self, subpath):
+		"""
+		Resolves ``subpath`` using :meth:`~View.get_resolver` and returns the match. The most recent match is remembered on the instance, so checking :meth:`handles_subpath` and then rendering the same subpath only resolves it once.
+		
+		:raises django.http.Http404: if the subpath can not be resolved.
+		
+		"""
+		if getattr(self, '_resolved_subpath', None) != subpath:
+			self._resolver_match = self.get_resolver().resolve(subpath)
+			self._resolved_subpath = subpath
+		return self._resolver_match
+	
 	def actually_render_to_response(self, request, extra_context=None):
 		"""
 		Resolves the remaining subpath left after finding this :class:`View`'s node using :attr:`self.urlpatterns <urlpatterns>` and renders the view function (or method) found with the appropriate args and kwargs.
 		
 		"""
-		clear_url_caches()
 		subpath = request.node._subpath
-		view, args, kwargs = resolve(subpath, urlconf=self)
-		view_args = getargspec(view)
+		view, args, kwargs = self.resolve_subpath(subpath)
+		kwargs = dict(kwargs)
+		view_args = get_argspec(view)
 		if extra_context is not None and ('extra_context' in view_args[0] or view_args[2] is not None):
 			if 'extra_context' in kwargs:
 				extra_context.update(kwargs['extra_context'])
@@ -385,10 +678,77 @@ class File(View):
 			if self.mimetype is None:
 				raise ValidationError("Unknown file type.")
 	
+	def get_etag(self, request, extra_context=None):
+		"""Returns an ETag built from the :class:`File`'s pk and the size and modification time reported by its storage, which does not require opening the file."""
+		try:
+			modified_time = self.file.storage.modified_time(self.file.name)
+			return "%s-%x-%x" % (self.pk, self.file.size, int(mktime(modified_time.timetuple())))
+		except (OSError, NotImplementedError):
+			return None
+	
+	def get_last_modified(self, request, extra_context=None):
+		"""Returns the modification time reported by the :class:`File`'s storage."""
+		try:
+			return self.file.storage.modified_time(self.file.name)
+		except (OSError, NotImplementedError):
+			return None
+	
+	def if_range_matches(self, request):
+		"""Returns ``False`` if the request has an ``If-Range`` header which does not match the :class:`File`'s current ETag or modification time, in which case any ``Range`` header must be ignored, and ``True`` otherwise."""
+		if_range = request.META.get('HTTP_IF_RANGE')
+		if not if_range:
+			return True
+		if if_range.startswith('"'):
+			etag = self.get_etag(request)
+			return etag is not None and if_range == quote_etag(etag)
+		last_modified = self.get_last_modified(request)
+		return last_modified is not None and parse_http_date_safe(if_range) == timegm(last_modified.utctimetuple())
+	
 	def actually_render_to_response(self, request, extra_context=None):
-		wrapper = FileWrapper(self.file)
-		response = HttpResponse(wrapper, content_type=self.mimetype)
-		response['Content-Length'] = self.file.size
+		"""
+		Returns an :class:`HttpResponse` for the :class:`File`. If :data:`SENDFILE_HEADER` is set, the response will be empty and the front-end server is expected to send the file - and to handle any ``Range`` requests. Otherwise, the file will be streamed, and ``Range`` requests will be answered with a ``206 Partial Content`` response containing the requested byte range or, for multiple ranges, a ``multipart/byteranges`` body.
+		
+		"""
+		if SENDFILE_HEADER:
+			response = HttpResponse(content_type=self.mimetype)
+			if SENDFILE_HEADER.lower() == 'x-accel-redirect':
+				response[SENDFILE_HEADER] = iri_to_uri(SENDFILE_URL_PREFIX + self.file.name)
+			else:
+				response[SENDFILE_HEADER] = smart_str(self.file.path)
+			response['Content-Disposition'] = "inline; filename=%s" % basename(self.file.name)
+			return response
+		
+		size = self.file.size
+		ranges = None
+		if request.method == 'GET' and self.if_range_matches(request):
+			ranges = parse_byte_ranges(request.META.get('HTTP_RANGE'), size)
+		
+		if ranges is None:
+			wrapper = FileWrapper(self.file)
+			response = HttpResponse(wrapper, content_type=self.mimetype)
+			response['Content-Length'] = size
+		elif not ranges:
+			response = HttpResponse(status=416)
+			response['Content-Range'] = 'bytes */%d' % size
+			return response
+		elif len(ranges) == 1:
+			first, last = ranges[0]
+			response = HttpResponse(_iter_file_range(self.file, first, last), content_type=self.mimetype, status=206)
+			response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+			response['Content-Length'] = last - first + 1
+		else:
+			boundary = uuid.uuid4().hex
+			headers = ["\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (boundary, self.mimetype, first, last, size) for first, last in ranges]
+			closing = "\r\n--%s--\r\n" % boundary
+			def iter_parts():
+				for header, (first, last) in zip(headers, ranges):
+					yield header
+					for data in _iter_file_range(self.file, first, last):
+						yield data
+				yield closing
+			response = HttpResponse(iter_parts(), content_type='multipart/byteranges; boundary=%s' % boundary, status=206)
+			response['Content-Length'] = sum([len(header) + last - first + 1 for header, (first, last) in zip(headers, ranges)]) + len(closing)
+		response['Accept-Ranges'] = 'bytes'
 		response['Content-Disposition'] = "inline; filename=%s" % basename(self.file.name)
 		return response
 	
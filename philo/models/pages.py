@@ -4,6 +4,7 @@
 
 """
 
+from hashlib import sha1
 import itertools
 
 from django.conf import settings
@@ -12,22 +13,28 @@ from django.contrib.contenttypes import generic
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.http import HttpResponse
-from django.template import TemplateDoesNotExist, Context, RequestContext, Template as DjangoTemplate, TextNode, VariableNode
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, Context, RequestContext, Template as DjangoTemplate, TextNode, VariableNode
+from django.template.loader import get_template
 from django.template.loader_tags import BlockNode, ExtendsNode, BlockContext
 from django.utils.datastructures import SortedDict
+from django.utils.encoding import smart_str
 
-from philo.models.base import SlugTreeEntity, register_value_model
-from philo.models.fields import TemplateField
+from philo.models.base import Entity, SlugTreeEntity, register_value_model, make_tree_version_key, make_path_hash
+from philo.models.fields import TemplateField, JSONField
 from philo.models.nodes import View
 from philo.signals import page_about_to_render_to_string, page_finished_rendering_to_string
 from philo.templatetags.containers import ContainerNode
-from philo.utils import fattr
+from philo.utils import fattr, bump_cache_version, get_cache_versions, make_object_version_key, make_model_version_key
 from philo.validators import LOADED_TEMPLATE_ATTR
 
 
 __all__ = ('Template', 'Page', 'Contentlet', 'ContentReference')
 
 
+#: Whether compiled :class:`Template`\ s should be cached in each process. This is controlled by the ``PHILO_TEMPLATE_CACHE`` setting. Default: ``False``.
+USE_TEMPLATE_CACHE = getattr(settings, 'PHILO_TEMPLATE_CACHE', False)
+
+
 class LazyContainerFinder(object):
 	def __init__(self, nodes, extends=False):
 		self.nodes = nodes
@@ -100,6 +107,49 @@ def build_extension_tree(nodelist):
 	return nodelists
 
 
+def resolve_constant_parents(template, seen=None):
+	"""Replaces the name of a constant ``{% extends %}`` parent in the compiled ``template`` with the compiled parent, and does the same for the parent's own parents, so that rendering ``template`` doesn't load and parse them again. Parents which can't be loaded, and recursive extends, are left alone so that the usual errors are raised when ``template`` is rendered."""
+	if seen is None:
+		seen = set()
+	for node in template.nodelist:
+		if not isinstance(node, TextNode):
+			if isinstance(node, ExtendsNode) and node.parent_name_expr is None and isinstance(node.parent_name, basestring) and node.parent_name not in seen:
+				seen.add(node.parent_name)
+				try:
+					parent = get_template(node.parent_name)
+				except (TemplateDoesNotExist, TemplateSyntaxError):
+					break
+				resolve_constant_parents(parent, seen)
+				node.parent_name = parent
+			break
+
+
+def find_loaded_template_paths(nodelist, paths=None):
+	"""Returns a list of the paths of the templates which are loaded by the nodes in ``nodelist`` - such as ``{% extends %}`` parents and constant ``{% include %}``\ s - and, recursively, by the templates they load. Paths are normalized as :meth:`~philo.models.base.SlugTreeEntityManager.get_with_path` would resolve them."""
+	if paths is None:
+		paths = []
+	for node in nodelist:
+		if hasattr(node, 'child_nodelists'):
+			for nodelist_name in node.child_nodelists:
+				child_nodelist = getattr(node, nodelist_name, None)
+				if child_nodelist:
+					find_loaded_template_paths(child_nodelist, paths)
+		
+		if hasattr(node, LOADED_TEMPLATE_ATTR):
+			loaded_template = getattr(node, LOADED_TEMPLATE_ATTR)
+			if loaded_template:
+				path = '/'.join([segment for segment in loaded_template.name.split('/') if segment])
+				if path not in paths:
+					paths.append(path)
+					find_loaded_template_paths(loaded_template.nodelist, paths)
+	return paths
+
+
+def make_code_hash(code):
+	"""Returns a hash of the given :class:`Template` ``code``."""
+	return sha1(smart_str(code)).hexdigest()
+
+
 class Template(SlugTreeEntity):
 	"""Represents a database-driven django template."""
 	#: The name of the template. Used for organization and debugging.
@@ -111,13 +161,36 @@ class Template(SlugTreeEntity):
 	#: An insecure :class:`~philo.models.fields.TemplateField` containing the django template code for this template.
 	code = TemplateField(secure=False, verbose_name='django template code')
 	
-	@property
-	def containers(self):
+	#: A :class:`~philo.models.fields.JSONField` which stores the result of the :attr:`containers` analysis. This is maintained automatically.
+	container_spec = JSONField(editable=False, default='null', blank=True)
+	
+	_compiled = {}
+	
+	def get_compiled(self):
 		"""
-		Returns a tuple where the first item is a list of names of contentlets referenced by containers, and the second item is a list of tuples of names and contenttypes of contentreferences referenced by containers. This will break if there is a recursive extends or includes in the template code. Due to the use of an empty Context, any extends or include tags with dynamic arguments probably won't work.
+		Returns a compiled django template for :attr:`code`. If :data:`USE_TEMPLATE_CACHE` is ``True``, compiled templates are shared in the current process by every instance with the same pk and code until any :class:`Template` is saved, moved, or deleted in any process sharing the same cache backend. Since templates can extend and include each other by path, any such change may affect the compiled result. Constant ``{% include %}`` tags are loaded when the code is parsed, and constant ``{% extends %}`` parents are loaded along with the cached template by :func:`resolve_constant_parents`, so rendering a cached template loads no other templates. Templates which are loaded from elsewhere, for example from the filesystem, are only reloaded when the :class:`Template` is recompiled, as with django's cached template loader.
 		
 		"""
-		template = DjangoTemplate(self.code)
+		if not USE_TEMPLATE_CACHE or self.pk is None:
+			return DjangoTemplate(self.code)
+		
+		code_hash = make_code_hash(self.code)
+		version = get_template_versions()
+		cached = Template._compiled.get(self.pk)
+		if cached is None or cached[0] != version or cached[1] != code_hash:
+			compiled = DjangoTemplate(self.code)
+			resolve_constant_parents(compiled)
+			cached = (version, code_hash, compiled)
+			Template._compiled[self.pk] = cached
+		return cached[2]
+	
+	def _analyze_containers(self):
+		# Parses the code and walks the templates it extends and includes to find
+		# the container specs. See :attr:`containers`.
+		template = self.get_compiled()
+		# Load the extended templates once for the analysis and for finding
+		# the paths of the templates it depends on.
+		resolve_constant_parents(template)
 		
 		# Build a tree of the templates we're using, placing the root template first.
 		levels = build_extension_tree(template.nodelist)
@@ -142,7 +215,73 @@ class Template(SlugTreeEntity):
 				contentlet_specs.extend(itertools.ifilter(lambda x: x not in contentlet_specs, block.contentlet_specs))
 				contentreference_specs.update(block.contentreference_specs)
 		
-		return contentlet_specs, contentreference_specs
+		return contentlet_specs, contentreference_specs, find_loaded_template_paths(template.nodelist)
+	
+	def _get_container_spec(self):
+		contentlet_specs, contentreference_specs, paths = self._analyze_containers()
+		code_hashes = get_template_code_hashes(paths)
+		return [make_code_hash(self.code), [[path, code_hashes.get(path)] for path in paths], contentlet_specs, [[name, content_type.pk] for name, content_type in contentreference_specs.items()]]
+	
+	def _is_current_container_spec(self, spec, code_hashes=None):
+		# A stored spec is current if it was computed for this code and every
+		# template it depends on still has the code it was computed with, or
+		# still doesn't exist. code_hashes may be passed in by callers which
+		# have already looked up the dependencies.
+		if spec is None or len(spec) != 4 or spec[0] != make_code_hash(self.code):
+			return False
+		dependencies = dict(spec[1])
+		if code_hashes is None:
+			code_hashes = get_template_code_hashes(dependencies.keys())
+		for path, code_hash in dependencies.items():
+			if code_hashes.get(path) != code_hash:
+				return False
+		return True
+	
+	def _store_container_spec(self, spec):
+		# The spec is only written if it was computed for the code which is
+		# stored in the database.
+		self.container_spec = spec
+		if self.pk is not None:
+			Template.objects.filter(pk=self.pk, code=self.code).update(container_spec=self.container_spec_json)
+	
+	def _update_container_spec(self):
+		# If the analysis fails, for example because an extended template
+		# doesn't exist yet, None is stored and the analysis is run again
+		# whenever containers is accessed until it succeeds.
+		try:
+			spec = self._get_container_spec()
+		except (TemplateSyntaxError, TemplateDoesNotExist):
+			spec = None
+		self._store_container_spec(spec)
+	
+	@property
+	def containers(self):
+		"""
+		Returns a tuple where the first item is a list of names of contentlets referenced by containers, and the second item is a list of tuples of names and contenttypes of contentreferences referenced by containers. This will break if there is a recursive extends or includes in the template code. Due to the use of an empty Context, any extends or include tags with dynamic arguments probably won't work.
+		
+		The analysis requires parsing the code and every template it extends or includes, so its result is stored in :attr:`container_spec` whenever a :class:`Template` is saved, moved, or deleted - see :func:`update_container_specs`. It is stored along with the paths and code hashes of the :class:`Template`\ s it was computed from, and reused for as long as :attr:`code` and those :class:`Template`\ s are unchanged, which costs a single query if the code extends or includes any other template. Otherwise, the analysis is run again; its result is kept on the instance but never written to the database.
+		
+		"""
+		spec = self.container_spec
+		if not self._is_current_container_spec(spec):
+			spec = self._get_container_spec()
+			self.container_spec = spec
+		return list(spec[2]), SortedDict([(name, ContentType.objects.get_for_id(content_type_id)) for name, content_type_id in spec[3]])
+	
+	def save(self, *args, **kwargs):
+		"""Saves the :class:`Template` and updates the stored :attr:`containers` analyses which depend on it."""
+		super(Template, self).save(*args, **kwargs)
+		update_container_specs()
+	
+	def delete(self, *args, **kwargs):
+		"""Deletes the :class:`Template` and updates the stored :attr:`containers` analyses which depended on it."""
+		super(Template, self).delete(*args, **kwargs)
+		update_container_specs()
+	
+	def move_to(self, target, position='first-child'):
+		"""Moves the :class:`Template` and updates the stored :attr:`containers` analyses which depend on its path or the paths of its descendants."""
+		super(Template, self).move_to(target, position)
+		update_container_specs()
 	
 	def __unicode__(self):
 		"""Returns the value of the :attr:`name` field."""
@@ -152,6 +291,33 @@ class Template(SlugTreeEntity):
 		app_label = 'philo'
 
 
+def get_template_versions():
+	"""Returns the current markers of the versions which are replaced whenever any :class:`Template` is saved, moved, or deleted. Cached compiled templates are only reused while these are unchanged."""
+	return get_cache_versions([make_model_version_key(ContentType.objects.get_for_model(Template).pk), make_tree_version_key(Template)])
+
+
+def get_template_code_hashes(paths):
+	"""Returns a dictionary mapping each of the given ``paths`` which belongs to a :class:`Template` to the :func:`make_code_hash` of that :class:`Template`'s code, using a single query."""
+	if not paths:
+		return {}
+	return dict([(full_path, make_code_hash(code)) for full_path, code in Template.objects.filter(full_path_hash__in=[make_path_hash(path) for path in paths]).values_list('full_path', 'code')])
+
+
+def update_container_specs():
+	"""Runs the :attr:`~Template.containers` analysis again for every :class:`Template` whose stored analysis is missing or stale - because its own code or the code or path of any :class:`Template` it extends or includes has changed - and stores the result. This is called whenever a :class:`Template` is saved, moved, or deleted, and costs two queries plus one query per updated :class:`Template`. Changes made without going through those methods, such as :meth:`QuerySet.update` calls or raw saves, are picked up the next time any :class:`Template` is saved."""
+	templates = list(Template.objects.all())
+	paths = set()
+	for template in templates:
+		spec = template.container_spec
+		if spec is not None and len(spec) == 4:
+			paths.update(dict(spec[1]).keys())
+	
+	code_hashes = get_template_code_hashes(list(paths))
+	for template in templates:
+		if not template._is_current_container_spec(template.container_spec, code_hashes):
+			template._update_container_spec()
+
+
 class Page(View):
 	"""
 	Represents a page - something which is rendered according to a :class:`Template`. The page will have a number of related :class:`Contentlet`\ s and :class:`ContentReference`\ s depending on the template selected - but these will appear only after the page has been saved with that template.
@@ -162,6 +328,9 @@ class Page(View):
 	#: The name of this page. Chances are this will be used for organization - i.e. finding the page in a list of pages - rather than for display.
 	title = models.CharField(max_length=255)
 	
+	#: Same as :attr:`View.cache_responses`. Default: ``True``
+	cache_responses = True
+	
 	def get_containers(self):
 		"""
 		Returns the results :attr:`~Template.containers` for the related template. This is a tuple containing the specs of all :ttag:`container`\ s in the :class:`Template`'s code. The value will be cached on the instance so that multiple accesses will be less expensive.
@@ -172,27 +341,104 @@ class Page(View):
 		return self._containers
 	containers = property(get_containers)
 	
+	def prefetch_container_content(self):
+		"""
+		Loads all of the :class:`Page`'s :class:`Contentlet`\ s and :class:`ContentReference`\ s with two queries, plus one per model referenced by the :class:`ContentReference`\ s to load their content, and keeps them on the instance. :ttag:`container` tags rendered for the :class:`Page` will then use them instead of running queries of their own. :meth:`render_to_string` does this for the duration of each render; call :meth:`clear_container_content` to discard the loaded content.
+		
+		"""
+		contentlets = {}
+		for contentlet in self.contentlets.all():
+			contentlets.setdefault(contentlet.name, contentlet)
+		
+		contentreferences = {}
+		lookups = {}
+		for contentreference in self.contentreferences.all():
+			contentreferences.setdefault((contentreference.name, contentreference.content_type_id), contentreference)
+			if contentreference.content_id is not None:
+				lookups.setdefault(contentreference.content_type_id, set()).add(contentreference.content_id)
+		
+		contents = {}
+		for content_type_id, pks in lookups.items():
+			contents[content_type_id] = ContentType.objects.get_for_id(content_type_id).model_class()._default_manager.in_bulk(list(pks))
+		
+		for contentreference in contentreferences.values():
+			try:
+				content = contents[contentreference.content_type_id][contentreference.content_id]
+			except KeyError:
+				# Leave missing content for the generic foreign key to report.
+				continue
+			setattr(contentreference, ContentReference.content.cache_attr, content)
+		
+		self._container_content = (contentlets, contentreferences)
+	
+	def clear_container_content(self):
+		"""Discards any content loaded by :meth:`prefetch_container_content`."""
+		if hasattr(self, '_container_content'):
+			del self._container_content
+	
+	def _has_containers(self):
+		# If the analysis fails, for example because of an extends tag with a
+		# dynamic argument, the template may still render containers.
+		try:
+			contentlet_specs, contentreference_specs = self.containers
+		except (TemplateSyntaxError, TemplateDoesNotExist):
+			return True
+		return bool(contentlet_specs or contentreference_specs)
+	
 	def render_to_string(self, request=None, extra_context=None):
 		"""
 		In addition to rendering as an :class:`HttpResponse`, a :class:`Page` can also render as a string. This means, for example, that :class:`Page`\ s can be used to render emails or other non-HTML content with the same :ttag:`container`-based functionality as is used for HTML.
 		
 		The :class:`Page` will add itself to the context as ``page`` and its :attr:`~.Entity.attributes` as ``attributes``. If a request is provided, then :class:`request.node <.Node>` will also be added to the context as ``node`` and ``attributes`` will be set to the result of calling :meth:`~.View.attributes_with_node` with that :class:`.Node`.
 		
+		The content of the :class:`Page`'s containers is loaded up front with :meth:`prefetch_container_content`, unless it has been loaded already or the :class:`Template` has no containers.
+		
 		"""
 		context = {}
 		context.update(extra_context or {})
 		context.update({'page': self, 'attributes': self.attributes})
-		template = DjangoTemplate(self.template.code)
+		template = self.template.get_compiled()
 		if request:
 			context.update({'node': request.node, 'attributes': self.attributes_with_node(request.node)})
 			page_about_to_render_to_string.send(sender=self, request=request, extra_context=context)
-			string = template.render(RequestContext(request, context))
+			context = RequestContext(request, context)
 		else:
 			page_about_to_render_to_string.send(sender=self, request=request, extra_context=context)
-		 	string = template.render(Context(context))
+			context = Context(context)
+		
+		# Content which was already loaded, e.g. by an enclosing render, is reused.
+		prefetched = hasattr(self, '_container_content') or not self._has_containers()
+		if not prefetched:
+			self.prefetch_container_content()
+		try:
+			string = template.render(context)
+		finally:
+			if not prefetched:
+				self.clear_container_content()
 		page_finished_rendering_to_string.send(sender=self, string=string)
 		return string
 	
+	def get_response_cache_tags(self, request):
+		"""
+		In addition to the tags described in :meth:`.View.get_response_cache_tags`, a :class:`Page`'s responses are tagged with every :class:`Template` (since templates can extend and include each other by path) and with the objects its :class:`ContentReference`\ s point to, whose markers are replaced by :func:`bump_content_version`. Changes to the :class:`Page`'s :class:`Contentlet`\ s and :class:`ContentReference`\ s replace the :class:`Page`'s own version marker.
+		
+		"""
+		tags = super(Page, self).get_response_cache_tags(request)
+		tags.append(make_model_version_key(ContentType.objects.get_for_model(Template).pk))
+		tags.append(make_tree_version_key(Template))
+		tags.extend([make_object_version_key(content_type_id, content_id) for content_type_id, content_id in self.contentreferences.filter(content_id__isnull=False).values_list('content_type', 'content_id')])
+		return tags
+	
+	def get_etag(self, request, extra_context=None):
+		"""
+		Returns an ETag derived from the current version markers of the :meth:`response cache tags <get_response_cache_tags>` - which change whenever the :class:`Page`, its :class:`Contentlet`\ s, :class:`ContentReference`\ s, :class:`Attribute`\ s, or any :class:`Template` change - and from the requesting user, since the :class:`Page` is rendered with a :class:`RequestContext`.
+		
+		"""
+		versions = get_cache_versions(self.get_response_cache_tags(request))
+		user = getattr(request, 'user', None)
+		user_id = user is not None and user.is_authenticated() and user.pk or None
+		return sha1(repr((sorted(versions.items()), user_id))).hexdigest()
+	
 	def actually_render_to_response(self, request, extra_context=None):
 		"""Returns an :class:`HttpResponse` with the content of the :meth:`render_to_string` method and the mimetype set to the :attr:`~Template.mimetype` of the related :class:`Template`."""
 		return HttpResponse(self.render_to_string(request, extra_context), mimetype=self.template.mimetype)
@@ -266,5 +512,27 @@ class ContentReference(models.Model):
 		app_label = 'philo'
 
 
+def bump_page_version(sender, instance, **kwargs):
+	"""Connected to the post_save and post_delete signals of :class:`Contentlet` and :class:`ContentReference`. Replaces the version markers of the related :class:`Page` and of the instance itself; the latter is used by the :ttag:`container` tag's ``cache`` option."""
+	bump_cache_version(make_object_version_key(ContentType.objects.get_for_model(Page).pk, instance.page_id))
+	bump_cache_version(make_object_version_key(ContentType.objects.get_for_model(sender).pk, instance.pk))
+
+
+for model in (Contentlet, ContentReference):
+	models.signals.post_save.connect(bump_page_version, sender=model)
+	models.signals.post_delete.connect(bump_page_version, sender=model)
+
+
+def bump_content_version(sender, instance, **kwargs):
+	"""Connected to the post_save and post_delete signals of every model. Replaces the version marker of the saved or deleted instance (see :func:`~philo.utils.make_object_version_key`), since a :class:`ContentReference` may point to an instance of any model. :class:`.Entity` subclasses are skipped, since :func:`~philo.models.base.bump_object_version` already replaces their markers."""
+	if sender is ContentType or issubclass(sender, Entity):
+		return
+	bump_cache_version(make_object_version_key(ContentType.objects.get_for_model(sender).pk, instance.pk))
+
+
+models.signals.post_save.connect(bump_content_version)
+models.signals.post_delete.connect(bump_content_version)
+
+
 register_value_model(Template)
 register_value_model(Page)
\ No newline at end of file
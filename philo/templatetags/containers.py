@@ -3,21 +3,34 @@ The container template tags are automatically included as builtins if :mod:`phil
 
 """
 
+from hashlib import sha1
+
 from django import template
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils.encoding import smart_str
 from django.utils.safestring import SafeUnicode, mark_safe
 
+from philo.utils import get_cache_version, make_object_version_key
+from philo.utils.templates import template_string_cache
+
+
+#: The prefix used for the cache keys of fragments cached by the :ttag:`container` tag's ``cache`` option.
+CONTAINER_CACHE_PREFIX = 'philo_container'
+
 
 register = template.Library()
 
 
 class ContainerNode(template.Node):
-	def __init__(self, name, references=None, as_var=None):
+	def __init__(self, name, references=None, as_var=None, timeout=None, vary_on=None):
 		self.name = name
 		self.as_var = as_var
 		self.references = references
+		self.timeout = timeout
+		self.vary_on = vary_on or []
 	
 	def render(self, context):
 		content = settings.TEMPLATE_STRING_IF_INVALID
@@ -37,31 +50,77 @@ class ContainerNode(template.Node):
 	
 	def get_container_content(self, context):
 		page = context['page']
+		try:
+			if self.references:
+				obj = self.get_contentreference(page)
+			else:
+				obj = self.get_contentlet(page)
+		except ObjectDoesNotExist:
+			if self.references:
+				return ''
+			return mark_safe(settings.TEMPLATE_STRING_IF_INVALID)
+		
+		if self.timeout is None:
+			return self.get_content(obj, context)
+		
+		timeout = self.timeout.resolve(context)
+		try:
+			timeout = int(timeout)
+		except (ValueError, TypeError):
+			raise template.TemplateSyntaxError('"container" tag got a non-integer timeout value: %r' % timeout)
+		
+		cache_key = self.get_cache_key(obj, context)
+		content = cache.get(cache_key)
+		if content is None:
+			content = self.get_content(obj, context)
+			cache.set(cache_key, content, timeout)
+		return content
+	
+	def get_content(self, obj, context):
+		"""Returns the content of the :class:`.ContentReference` or the rendered content of the :class:`.Contentlet` ``obj``."""
 		if self.references:
-			# Then it's a content reference.
 			try:
-				contentreference = page.contentreferences.get(name__exact=self.name, content_type=self.references)
-				content = contentreference.content
+				return obj.content
 			except ObjectDoesNotExist:
-				content = ''
-		else:
-			# Otherwise it's a contentlet.
+				return ''
+		
+		if '{%' in obj.content or '{{' in obj.content:
 			try:
-				contentlet = page.contentlets.get(name__exact=self.name)
-				if '{%' in contentlet.content or '{{' in contentlet.content:
-					try:
-						content = template.Template(contentlet.content, name=contentlet.name).render(context)
-					except template.TemplateSyntaxError, error:
-						if settings.DEBUG:
-							content = ('[Error parsing contentlet \'%s\': %s]' % (self.name, error))
-						else:
-							content = settings.TEMPLATE_STRING_IF_INVALID
+				content = template_string_cache.get_template(obj.content, name=obj.name).render(context)
+			except template.TemplateSyntaxError, error:
+				if settings.DEBUG:
+					content = ('[Error parsing contentlet \'%s\': %s]' % (self.name, error))
 				else:
-					content = contentlet.content
-			except ObjectDoesNotExist:
-				content = settings.TEMPLATE_STRING_IF_INVALID
-			content = mark_safe(content)
-		return content
+					content = settings.TEMPLATE_STRING_IF_INVALID
+		else:
+			content = obj.content
+		return mark_safe(content)
+	
+	def get_cache_key(self, obj, context):
+		"""Returns the key used to cache this container's content for the :class:`.Contentlet` ``obj``. The key changes whenever ``obj`` is saved and whenever the values of the ``vary_on`` variables change. Everything but the prefix is hashed, so the key is valid for any cache backend whatever the container's name."""
+		version = get_cache_version(make_object_version_key(ContentType.objects.get_for_model(obj).pk, obj.pk))
+		parts = [unicode(obj.page_id), self.name, unicode(obj.pk), version] + [unicode(var.resolve(context)) for var in self.vary_on]
+		return '%s:%s' % (CONTAINER_CACHE_PREFIX, sha1(smart_str(u':'.join(parts))).hexdigest())
+	
+	def get_contentlet(self, page):
+		"""Returns the :class:`.Contentlet` for this container, from the ``page``'s prefetched container content if it has any (see :meth:`.Page.prefetch_container_content`)."""
+		prefetched = getattr(page, '_container_content', None)
+		if prefetched is None:
+			return page.contentlets.get(name__exact=self.name)
+		try:
+			return prefetched[0][self.name]
+		except KeyError:
+			raise ObjectDoesNotExist
+	
+	def get_contentreference(self, page):
+		"""Returns the :class:`.ContentReference` for this container, from the ``page``'s prefetched container content if it has any (see :meth:`.Page.prefetch_container_content`)."""
+		prefetched = getattr(page, '_container_content', None)
+		if prefetched is None:
+			return page.contentreferences.get(name__exact=self.name, content_type=self.references)
+		try:
+			return prefetched[1][(self.name, self.references.pk)]
+		except KeyError:
+			raise ObjectDoesNotExist
 
 
 @register.tag
@@ -71,7 +130,11 @@ def container(parser, token):
 	
 	Usage::
 	
-		{% container <name> [[references <app_label>.<model_name>] as <variable>] %}
+		{% container <name> [[references <app_label>.<model_name>] as <variable>] [cache <timeout> [<vary_on> ...]] %}
+	
+	If the ``cache`` option is given, the container's rendered content is cached for ``timeout`` seconds per page, container, and version of the :class:`.Contentlet`, so that the cached fragment is discarded as soon as its content is saved. As with django's ``{% cache %}`` tag, a timeout which isn't an integer raises a :exc:`TemplateSyntaxError` when the container is rendered. The ``cache`` option can't be combined with ``references``: the content of a :class:`.ContentReference` is a model instance rather than rendered text, and is fetched with a single query anyway. Since a contentlet's template code might depend on other context variables, any additional arguments are resolved against the context and included in the cache key, as with django's ``{% cache %}`` tag. For example::
+	
+		{% container sidebar cache 600 request.user.is_authenticated %}
 	
 	"""
 	params = token.split_contents()
@@ -80,6 +143,8 @@ def container(parser, token):
 		name = params[1].strip('"')
 		references = None
 		as_var = None
+		timeout = None
+		vary_on = []
 		if len(params) > 2:
 			remaining_tokens = params[2:]
 			while remaining_tokens:
@@ -99,9 +164,18 @@ def container(parser, token):
 						as_var = remaining_tokens.pop(0)
 					except IndexError:
 						raise template.TemplateSyntaxError('"%s" template tag option "as" requires an argument specifying a variable name' % tag)
+				elif option_token == 'cache':
+					try:
+						timeout = parser.compile_filter(remaining_tokens.pop(0))
+					except IndexError:
+						raise template.TemplateSyntaxError('"%s" template tag option "cache" requires an argument specifying a timeout' % tag)
+					while remaining_tokens and remaining_tokens[0] not in ('references', 'as'):
+						vary_on.append(parser.compile_filter(remaining_tokens.pop(0)))
 			if references and not as_var:
 				raise template.TemplateSyntaxError('"%s" template tags using "references" option require additional use of the "as" option specifying a variable name' % tag)
-		return ContainerNode(name, references, as_var)
+			if references and timeout is not None:
+				raise template.TemplateSyntaxError('"%s" template tag option "cache" can\'t be combined with the "references" option' % tag)
+		return ContainerNode(name, references, as_var, timeout, vary_on)
 		
 	else: # error
 		raise template.TemplateSyntaxError('"%s" template tag provided without arguments (at least one required)' % tag)
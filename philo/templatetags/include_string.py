@@ -1,6 +1,8 @@
 from django import template
 from django.conf import settings
 
+from philo.utils.templates import template_string_cache
+
 
 register = template.Library()
 
@@ -11,7 +13,7 @@ class IncludeStringNode(template.Node):
 	
 	def render(self, context):
 		try:
-			t = template.Template(self.string.resolve(context))
+			t = template_string_cache.get_template(self.string.resolve(context))
 			return t.render(context)
 		except template.TemplateSyntaxError:
 			if settings.TEMPLATE_DEBUG:
@@ -24,7 +26,7 @@ class IncludeStringNode(template.Node):
 @register.tag
 def include_string(parser, token):
 	"""
-	Include a flat string by interpreting it as a template. The compiled template will be rendered with the current context.
+	Include a flat string by interpreting it as a template. The compiled template will be rendered with the current context. Compiled templates are shared with :ttag:`container` through :data:`~philo.utils.templates.template_string_cache`.
 	
 	Usage::
 	
@@ -6,7 +6,6 @@ The node template tags are automatically included as builtins if :mod:`philo` is
 from django import template
 from django.conf import settings
 from django.contrib.sites.models import Site
-from django.core.urlresolvers import reverse, NoReverseMatch
 from django.template.defaulttags import kwarg_re
 from django.utils.encoding import smart_str
 
@@ -54,8 +53,8 @@ class NodeURLNode(template.Node):
 			
 			url = ''
 			try:
-				subpath = reverse(view_name, urlconf=node.view, args=args, kwargs=kwargs)
-			except NoReverseMatch:
+				subpath = node.view.reverse(view_name, args=args, kwargs=kwargs)
+			except ViewCanNotProvideSubpath:
 				if self.as_var is None:
 					if settings.TEMPLATE_DEBUG:
 						raise
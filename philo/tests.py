@@ -4,7 +4,9 @@ import traceback
 from django import template
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.db import connection, models
+from django.http import HttpRequest
 from django.template import loader
 from django.template.loaders import cached
 from django.test import TestCase
@@ -12,7 +14,9 @@ from django.test.utils import setup_test_template_loader, restore_template_loade
 from django.utils.datastructures import SortedDict
 
 from philo.exceptions import AncestorDoesNotExist
-from philo.models import Node, Page, Template, Tag
+from philo.models import Node, Page, Template, Tag, Contentlet, ContentReference
+from philo.models.nodes import parse_byte_ranges
+from philo.utils import get_cache_versions, check_cache_versions, bump_cache_version, make_model_version_key, entities
 
 
 class TemplateTestCase(TestCase):
@@ -129,6 +133,668 @@ class NodeURLTestCase(TestCase):
 	def test_nodeurl(self):
 		for string, result in self.templates:
 			self.assertEqual(template.Template(string).render(self.context), result)
+	
+	def test_urls_for(self):
+		nodes = Node.objects.filter(slug__in=['root', 'second', 'third', 'second2'])
+		urls = dict([(node.pk, node.get_absolute_url()) for node in nodes])
+		self.assertEqual(Node.objects.urls_for(nodes), urls)
+		self.assertEqual(Node.objects.urls_for(list(nodes)), urls)
+		
+		root = Node.objects.get(slug='second')
+		third = Node.objects.get(slug='third')
+		self.assertEqual(Node.objects.urls_for(nodes, root=root), {root.pk: '/', third.pk: '/third'})
+		
+		# Nodes outside of the root are left out, including nodes in other
+		# trees and siblings whose paths merely start with the same text.
+		view = root.view
+		other_root = Node.objects.create(slug='second', view=view)
+		other = Node.objects.create(slug='third', parent=other_root, view=view)
+		sibling = Node.objects.create(slug='second-sibling', parent=root.parent, view=view)
+		outside = [other_root, other, sibling, root.parent, Node.objects.get(slug='second2')]
+		self.assertEqual(Node.objects.urls_for(outside, root=root), {})
+		self.assertEqual(Node.objects.urls_for(Node.objects.filter(pk__in=[node.pk for node in outside] + [third.pk]), root=root), {third.pk: '/third'})
+
+
+class AttributeTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def normalize(self, nodes):
+		attributes = {}
+		for node in nodes:
+			attributes[node.pk] = dict([(key, isinstance(value, models.query.QuerySet) and list(value) or value) for key, value in node.attributes.items()])
+		return attributes
+	
+	def test_prefetch_attributes(self):
+		Node.objects.get(slug='root').attributes['theme'] = 'dark'
+		second = Node.objects.get(slug='second')
+		second.attributes['tag'] = Tag.objects.all()[0]
+		second.attributes['tags'] = Tag.objects.all()
+		
+		expected = self.normalize(Node.objects.all())
+		nodes = list(Node.objects.prefetch_attributes())
+		settings.DEBUG = True
+		try:
+			queries = len(connection.queries)
+			for node in nodes:
+				node.attributes.items()
+			self.assertEqual(len(connection.queries), queries)
+		finally:
+			settings.DEBUG = False
+		self.assertEqual(self.normalize(nodes), expected)
+	
+	def test_prefetch_attribute_keys(self):
+		from philo.models import prefetch_attributes
+		Node.objects.get(slug='root').attributes['theme'] = 'dark'
+		second = Node.objects.get(slug='second')
+		second.attributes['analytics'] = 'UA-1'
+		expected = self.normalize(Node.objects.all())
+		
+		def count_queries(callable):
+			settings.DEBUG = True
+			try:
+				queries = len(connection.queries)
+				callable()
+				return len(connection.queries) - queries
+			finally:
+				settings.DEBUG = False
+		
+		# Mappers which aren't lazy are seeded in full, whatever the keys.
+		nodes = list(Node.objects.prefetch_attributes(keys=['theme']))
+		self.assertEqual(count_queries(lambda: [node.attributes.items() for node in nodes]), 0)
+		self.assertEqual(self.normalize(nodes), expected)
+		
+		# Lazy mappers are only seeded with the given keys, and remember which
+		# of them are missing.
+		second = Node.objects.get(pk=second.pk)
+		second._attributes = second.get_attribute_mapper(entities.LazyTreeAttributeMapper)
+		prefetch_attributes([second], keys=['theme', 'missing'])
+		self.assertEqual(count_queries(lambda: second.attributes['theme']), 0)
+		self.assertEqual(count_queries(lambda: self.assertRaises(KeyError, second.attributes.__getitem__, 'missing')), 0)
+		self.assertFalse('analytics' in second.attributes._cache)
+		self.assertEqual(second.attributes['analytics'], 'UA-1')
+	
+	def test_attribute_closure(self):
+		from philo.models import base
+		base.USE_ATTRIBUTE_CLOSURE = True
+		try:
+			root = Node.objects.get(slug='root')
+			root.attributes['theme'] = 'dark'
+			base.rebuild_attribute_closure(Node)
+			second = Node.objects.get(slug='second')
+			closure = second.get_attribute_mapper(entities.ClosureAttributeMapper)
+			self.assertEqual(closure['theme'], 'dark')
+			
+			second.attributes['theme'] = 'light'
+			descendant = second.get_descendants()[0]
+			self.assertEqual(descendant.get_attribute_mapper(entities.ClosureAttributeMapper)['theme'], 'light')
+			
+			# Saving a node without changing its parent leaves the closure alone.
+			settings.DEBUG = True
+			try:
+				queries = len(connection.queries)
+				Node.objects.get(pk=second.pk).save()
+				self.assertEqual([query for query in connection.queries[queries:] if base.InheritedAttribute._meta.db_table in query['sql']], [])
+			finally:
+				settings.DEBUG = False
+			
+			for node in Node.objects.all():
+				closure = dict(node.get_attribute_mapper(entities.ClosureAttributeMapper).items())
+				tree = dict(node.get_attribute_mapper(node.parent_id and entities.TreeAttributeMapper or entities.AttributeMapper).items())
+				self.assertEqual(closure, tree)
+			
+			second.attribute_set.get(key='theme').delete()
+			self.assertEqual(Node.objects.get(pk=descendant.pk).get_attribute_mapper(entities.ClosureAttributeMapper)['theme'], 'dark')
+		finally:
+			base.USE_ATTRIBUTE_CLOSURE = False
+	
+	def test_inline_json_values(self):
+		from philo.models import base
+		root = Node.objects.get(slug='root')
+		root.attributes['theme'] = 'dark'
+		base.USE_INLINE_JSON_VALUES = True
+		try:
+			root.attributes['theme'] = 'light'
+			attribute = root.attribute_set.get(key='theme')
+			self.assertEqual(attribute.value_content_type_id, None)
+			self.assertEqual(attribute.get_python_value(), 'light')
+			self.assertEqual(base.JSONValue.objects.count(), 0)
+			self.assertEqual(Node.objects.get(slug='root').attributes['theme'], 'light')
+			self.assertEqual(list(Node.objects.filter(slug='root').prefetch_attributes())[0].attributes['theme'], 'light')
+		finally:
+			base.USE_INLINE_JSON_VALUES = False
+		
+		root = Node.objects.get(slug='root')
+		root.attributes['theme'] = 'dark'
+		attribute = root.attribute_set.get(key='theme')
+		self.assertEqual(attribute.inline_value, None)
+		self.assertEqual(attribute.get_python_value(), 'dark')
+	
+	def test_attribute_form_inline_value(self):
+		from django.forms.models import modelform_factory
+		from philo.admin.forms.attributes import AttributeForm
+		from philo.models import Attribute, JSONValue
+		Form = modelform_factory(Attribute, form=AttributeForm, fields=['key', 'value_content_type', 'inline_value'])
+		json_ct = ContentType.objects.get_for_model(JSONValue)
+		
+		attribute = Attribute(entity=Node.objects.get(slug='root'), key='theme')
+		attribute.inline_value = 'dark'
+		attribute.save()
+		self.assertEqual(Form(instance=attribute).initial['inline_value'], '"dark"')
+		
+		# Choosing a value type clears the inline value.
+		form = Form({'key': 'theme', 'value_content_type': json_ct.pk, 'inline_value': '"dark"'}, instance=attribute)
+		self.assertTrue(form.is_valid())
+		form.save()
+		attribute = Attribute.objects.get(pk=attribute.pk)
+		self.assertEqual(attribute.inline_value, None)
+		self.assertTrue(isinstance(attribute.value, JSONValue))
+		
+		# Entering an inline value replaces the related value.
+		form = Form({'key': 'theme', 'value_content_type': json_ct.pk, 'inline_value': '"light"', 'value': 'null'}, instance=attribute)
+		self.assertTrue(form.is_valid())
+		form.save()
+		attribute = Attribute.objects.get(pk=attribute.pk)
+		self.assertEqual((attribute.value_content_type_id, attribute.value_object_id), (None, None))
+		self.assertEqual(attribute.get_python_value(), 'light')
+		self.assertEqual(JSONValue.objects.count(), 0)
+	
+	def test_many_to_many_value(self):
+		from philo.models import ManyToManyValue, ForeignKeyValue
+		Tag.objects.create(name='Second', slug='second')
+		tags = list(Tag.objects.all())
+		value = ManyToManyValue()
+		value.set_value(Tag.objects.all())
+		self.assertEqual(set(value.object_ids), set([tag.pk for tag in tags]))
+		
+		kept = ForeignKeyValue.objects.get(manytomanyvalue=value, object_id=tags[0].pk).pk
+		value.set_value(Tag.objects.filter(pk=tags[0].pk))
+		self.assertEqual(list(value.object_ids), [tags[0].pk])
+		self.assertEqual(list(value.values.values_list('pk', flat=True)), [kept])
+		self.assertEqual(list(value.value), [tags[0]])
+		
+		value.set_value(Tag.objects.none())
+		self.assertEqual(list(value.object_ids), [])
+		self.assertEqual(list(value.value), [])
+		
+		# An unrelated value for the same object must not be picked up.
+		unrelated = ForeignKeyValue.objects.create(content_type=value.content_type, object_id=tags[0].pk)
+		for i in range(10):
+			Tag.objects.create(name='Tag %d' % i, slug='tag-%d' % i)
+		
+		value.set_value(Tag.objects.all()[:2])
+		value.set_value(Tag.objects.all())
+		self.assertEqual(set(value.object_ids), set(Tag.objects.values_list('pk', flat=True)))
+		self.assertEqual(value.values.count(), Tag.objects.count())
+		self.assertFalse(value.values.filter(pk=unrelated.pk).exists())
+		value.set_value(Tag.objects.none())
+		self.assertTrue(ForeignKeyValue.objects.filter(pk=unrelated.pk).exists())
+		
+	def test_set_attribute_values(self):
+		from philo.models import JSONValue, ForeignKeyValue, ManyToManyValue, set_attribute_values
+		root = Node.objects.get(slug='root')
+		root.attributes['theme'] = 'dark'
+		root.attributes['tag'] = 'not a tag'
+		tag = Tag.objects.all()[0]
+		
+		set_attribute_values(root, [
+			('theme', 'light', JSONValue),
+			('tag', tag, ForeignKeyValue),
+			('tags', Tag.objects.all(), ManyToManyValue),
+		])
+		attributes = Node.objects.get(slug='root').attributes
+		self.assertEqual(attributes['theme'], 'light')
+		self.assertEqual(attributes['tag'], tag)
+		self.assertEqual(list(attributes['tags']), list(Tag.objects.all()))
+		# The replaced JSONValue for 'tag' is gone; 'theme' was updated in place.
+		self.assertEqual(JSONValue.objects.count(), 1)
+	
+	def test_attribute_mapper_update(self):
+		root = Node.objects.get(slug='root')
+		keys = ['key%d' % i for i in range(10)]
+		root.attributes.update(dict([(key, 0) for key in keys]))
+		
+		def count_queries(mapping):
+			settings.DEBUG = True
+			try:
+				queries = len(connection.queries)
+				Node.objects.get(slug='root').attributes.update(mapping)
+				return len(connection.queries) - queries
+			finally:
+				settings.DEBUG = False
+		
+		self.assertEqual(count_queries(dict([(key, 1) for key in keys[:2]])), count_queries(dict([(key, 2) for key in keys])))
+		
+		tag = Tag.objects.all()[0]
+		root.attributes.update(key0='zero', tag=tag)
+		self.assertEqual(root.attributes['key0'], 'zero')
+		self.assertEqual(root.attributes['tag'], tag)
+		attributes = Node.objects.get(slug='root').attributes
+		self.assertEqual(attributes['key0'], 'zero')
+		self.assertEqual(attributes['key9'], 2)
+		self.assertEqual(attributes['tag'], tag)
+		self.assertRaises(ValidationError, root.attributes.update, {'!!!': 1})
+	
+	def test_filter_attribute(self):
+		from philo.models import base
+		root = Node.objects.get(slug='root')
+		second = Node.objects.get(slug='second')
+		root.attributes['theme'] = 'dark'
+		second.attributes['theme'] = 'light'
+		
+		self.assertEqual(list(Node.objects.filter_attribute('theme', 'dark')), [root])
+		
+		expected = set(root.get_descendants(include_self=True).exclude(pk__in=second.get_descendants(include_self=True)).values_list('pk', flat=True))
+		self.assertEqual(set(Node.objects.filter_attribute('theme', 'dark', inherited=True).values_list('pk', flat=True)), expected)
+		
+		base.USE_ATTRIBUTE_CLOSURE = True
+		try:
+			base.rebuild_attribute_closure(Node)
+			self.assertEqual(set(Node.objects.filter_attribute('theme', 'dark', inherited=True).values_list('pk', flat=True)), expected)
+		finally:
+			base.USE_ATTRIBUTE_CLOSURE = False
+		
+		tag = Tag.objects.all()[0]
+		second.attributes['tag'] = tag
+		self.assertEqual(list(Node.objects.filter_attribute('tag', tag)), [second])
+		self.assertEqual(list(Node.objects.filter_attribute('theme', 'blue', inherited=True)), [])
+		
+		# The inherited lookup is a single query, however many nodes declare the key.
+		for node in second.get_descendants():
+			node.attributes['theme'] = 'light'
+		expected = set(root.get_descendants(include_self=True).exclude(pk__in=second.get_descendants(include_self=True)).values_list('pk', flat=True))
+		settings.DEBUG = True
+		try:
+			queries = len(connection.queries)
+			self.assertEqual(set(Node.objects.filter_attribute('theme', 'dark', inherited=True).values_list('pk', flat=True)), expected)
+			self.assertEqual(len(connection.queries), queries + 1)
+		finally:
+			settings.DEBUG = False
+		
+		# Dictionaries match regardless of the order their keys were given in.
+		options = SortedDict([('b', 1), ('a', 2)])
+		root.attributes['options'] = options
+		self.assertEqual(list(Node.objects.filter_attribute('options', dict(options))), [root])
+		self.assertEqual(list(Node.objects.filter_attribute('options', SortedDict([('a', 2), ('b', 1)]))), [root])
+		
+		from philo.models import JSONValue, Attribute
+		value = JSONValue()
+		value.value = options
+		value.save()
+		Attribute.objects.create(entity=second, key='options', value=value)
+		self.assertEqual(list(Node.objects.filter_attribute('options', {'a': 2, 'b': 1}).order_by('pk')), sorted([root, second], key=lambda node: node.pk))
+		self.assertEqual(value.value_hash, base.make_json_hash(value.value_json))
+		
+		# Values are looked up by their hash, so values of any length can be found.
+		text = 'x' * 5000
+		root.attributes['text'] = text
+		attribute = Attribute.objects.get(entity_object_id=root.pk, entity_content_type=ContentType.objects.get_for_model(Node), key='text')
+		self.assertEqual(attribute.inline_value_hash, base.make_json_hash(attribute.inline_value_json))
+		self.assertEqual(list(Node.objects.filter_attribute('text', text)), [root])
+	
+	def test_cached_attribute_mapper(self):
+		root = Node.objects.get(slug='root')
+		tag = Tag.objects.all()[0]
+		root.attributes.update(theme='dark', tag=tag, tags=Tag.objects.all())
+		
+		expected = dict(Node.objects.get(pk=root.pk).get_attribute_mapper(entities.CachedAttributeMapper).items())
+		settings.DEBUG = True
+		try:
+			queries = len(connection.queries)
+			mapper = root.get_attribute_mapper(entities.CachedAttributeMapper)
+			self.assertEqual(mapper['theme'], 'dark')
+			# Only the instance a ForeignKeyValue points to is fetched again.
+			self.assertEqual(len(connection.queries), queries + 1)
+		finally:
+			settings.DEBUG = False
+		self.assertEqual(mapper['tag'], expected['tag'])
+		self.assertEqual(list(mapper['tags']), list(expected['tags']))
+		
+		root.attributes['theme'] = 'light'
+		self.assertEqual(root.get_attribute_mapper(entities.CachedAttributeMapper)['theme'], 'light')
+		tag.name = 'Renamed'
+		tag.save()
+		self.assertEqual(root.get_attribute_mapper(entities.CachedAttributeMapper)['tag'].name, 'Renamed')
+	
+	def test_lazy_tree_preload(self):
+		Node.objects.get(slug='root').attributes['theme'] = 'dark'
+		second = Node.objects.get(slug='second')
+		second.attributes['analytics'] = 'UA-1'
+		mapper = second.get_attribute_mapper(entities.LazyTreeAttributeMapper)
+		settings.DEBUG = True
+		try:
+			queries = len(connection.queries)
+			mapper.preload(['theme', 'analytics', 'missing'])
+			# Ancestors, attributes, and values.
+			self.assertEqual(len(connection.queries) - queries, 3)
+			
+			queries = len(connection.queries)
+			self.assertEqual(mapper['theme'], 'dark')
+			self.assertEqual(mapper['analytics'], 'UA-1')
+			self.assertRaises(KeyError, mapper.__getitem__, 'missing')
+			self.assertEqual(mapper.get_attribute('missing'), None)
+			self.assertEqual(len(connection.queries), queries)
+		finally:
+			settings.DEBUG = False
+	
+	def test_lazy_tree_lookups(self):
+		Node.objects.get(slug='root').attributes['theme'] = 'dark'
+		Node.objects.get(slug='second').attributes['analytics'] = 'UA-1'
+		mapper = Node.objects.get(slug='second').get_attribute_mapper(entities.LazyTreeAttributeMapper)
+		settings.DEBUG = True
+		try:
+			queries = len(connection.queries)
+			self.assertEqual(mapper['theme'], 'dark')
+			# Ancestors, the attribute, and its value.
+			self.assertEqual(len(connection.queries) - queries, 3)
+			
+			# The ancestors are only looked up once.
+			queries = len(connection.queries)
+			self.assertEqual(mapper['analytics'], 'UA-1')
+			self.assertEqual(len(connection.queries) - queries, 2)
+			self.assertFalse(mapper._cache_filled)
+			
+			# Missing keys are only looked up once.
+			queries = len(connection.queries)
+			self.assertEqual(mapper.get_attribute('missing'), None)
+			self.assertRaises(KeyError, mapper.__getitem__, 'missing')
+			self.assertEqual(len(connection.queries) - queries, 1)
+		finally:
+			settings.DEBUG = False
+	
+	def test_render_attribute_lookups(self):
+		Node.objects.get(slug='root').attributes['theme'] = 'dark'
+		Node.objects.get(slug='second').attributes['analytics'] = 'UA-1'
+		
+		def count_queries(code):
+			request = HttpRequest()
+			request.node = Node.objects.get(slug='second')
+			page = request.node.view
+			page.template.code = code
+			settings.DEBUG = True
+			try:
+				queries = len(connection.queries)
+				page.render_to_string(request)
+				return len(connection.queries) - queries
+			finally:
+				settings.DEBUG = False
+		
+		# The number of queries doesn't depend on the number of keys a template uses.
+		self.assertEqual(count_queries('{{ attributes.theme }}'), count_queries('{{ attributes.theme }}{{ attributes.analytics }}{{ attributes.missing }}{{ attributes.other }}'))
+	
+	def test_shared_tree_attribute_cache(self):
+		entities.USE_TREE_ATTRIBUTE_CACHE = True
+		settings.DEBUG = True
+		try:
+			root = Node.objects.get(slug='root')
+			root.attributes['theme'] = 'dark'
+			self.assertEqual(Node.objects.get(slug='second').attributes['theme'], 'dark')
+			
+			second = Node.objects.get(slug='second')
+			queries = len(connection.queries)
+			self.assertEqual(second.attributes['theme'], 'dark')
+			self.assertEqual(len(connection.queries), queries)
+			
+			root.attributes['theme'] = 'light'
+			self.assertEqual(Node.objects.get(slug='second').attributes['theme'], 'light')
+		finally:
+			entities.USE_TREE_ATTRIBUTE_CACHE = False
+			settings.DEBUG = False
+
+
+class ResponseCacheTestCase(TestCase):
+	urls = 'philo.urls'
+	fixtures = ['test_fixtures.json']
+	
+	def setUp(self):
+		self.node = Node.objects.filter(view_content_type=ContentType.objects.get_for_model(Page))[0]
+		self.request = HttpRequest()
+		self.request.node = self.node
+	
+	def get_versions(self):
+		return get_cache_versions(self.node.view.get_response_cache_tags(self.request))
+	
+	def test_page_invalidation(self):
+		page = self.node.view
+		other = Page.objects.exclude(pk=page.pk)[0]
+		
+		versions = self.get_versions()
+		self.assertTrue(check_cache_versions(versions))
+		Contentlet.objects.create(page=other, name='unrelated', content='')
+		self.assertTrue(check_cache_versions(versions))
+		Contentlet.objects.create(page=page, name='related', content='')
+		self.assertFalse(check_cache_versions(versions))
+		
+		versions = self.get_versions()
+		page.attributes['title'] = 'Changed'
+		self.assertFalse(check_cache_versions(versions))
+		
+		versions = self.get_versions()
+		page.template.save()
+		self.assertFalse(check_cache_versions(versions))
+		
+		versions = self.get_versions()
+		self.node.get_root().save()
+		self.assertFalse(check_cache_versions(versions))
+		
+		# Referenced objects which aren't entities invalidate responses, too.
+		tag = Tag.objects.all()[0]
+		other_tag = Tag.objects.create(name='Other', slug='other-tag')
+		ContentReference.objects.create(page=page, name='tag', content=tag)
+		versions = self.get_versions()
+		other_tag.save()
+		self.assertTrue(check_cache_versions(versions))
+		tag.save()
+		self.assertFalse(check_cache_versions(versions))
+	
+	def test_page_etag(self):
+		page = self.node.view
+		etag = page.get_etag(self.request)
+		self.assertEqual(page.get_etag(self.request), etag)
+		Contentlet.objects.create(page=page, name='related', content='')
+		self.assertNotEqual(page.get_etag(self.request), etag)
+	
+	def test_resolver_cache(self):
+		view = self.node.view
+		resolver = view.get_resolver()
+		self.assertTrue(Page.objects.get(pk=view.pk).get_resolver() is resolver)
+		
+		# Only changes to the view itself discard the compiled resolver.
+		Node.objects.exclude(pk=self.node.pk)[0].save()
+		self.assertTrue(Page.objects.get(pk=view.pk).get_resolver() is resolver)
+		view.save()
+		self.assertFalse(Page.objects.get(pk=view.pk).get_resolver() is resolver)
+	
+	def test_node_view(self):
+		from django.core.cache import cache
+		from philo import views
+		from philo.signals import page_about_to_render_to_string
+		rendered = []
+		def page_rendered(sender, **kwargs):
+			rendered.append(sender)
+		
+		old_middleware = settings.MIDDLEWARE_CLASSES
+		settings.MIDDLEWARE_CLASSES = (
+			'philo.middleware.ResponseCacheMiddleware',
+			'django.contrib.sessions.middleware.SessionMiddleware',
+			'django.middleware.csrf.CsrfViewMiddleware',
+			'django.contrib.auth.middleware.AuthenticationMiddleware',
+			'django.contrib.messages.middleware.MessageMiddleware',
+			'philo.middleware.RequestNodeMiddleware',
+		)
+		views.USE_RESPONSE_CACHE = True
+		page_about_to_render_to_string.connect(page_rendered)
+		cache.clear()
+		try:
+			url = self.node.get_absolute_url()
+			self.assertEqual(self.client.get(url).status_code, 200)
+			self.assertEqual(self.client.get(url).status_code, 200)
+			self.assertEqual(len(rendered), 1)
+			
+			# A page with a CSRF token must be rendered for every visitor.
+			template = self.node.view.template
+			template.code = '{% csrf_token %}'
+			template.save()
+			response = self.client.get(url)
+			self.assertTrue(settings.CSRF_COOKIE_NAME in response.cookies)
+			self.client.cookies.clear()
+			self.client.get(url)
+			self.assertEqual(len(rendered), 3)
+		finally:
+			page_about_to_render_to_string.disconnect(page_rendered)
+			views.USE_RESPONSE_CACHE = False
+			settings.MIDDLEWARE_CLASSES = old_middleware
+
+
+class ConditionalRequestTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def get_request(self, node, **headers):
+		request = HttpRequest()
+		request.method = 'GET'
+		request.META.update(headers)
+		request.node = node
+		return request
+	
+	def test_page_etag(self):
+		from django.utils.http import quote_etag
+		node = Node.objects.filter(view_content_type=ContentType.objects.get_for_model(Page))[0]
+		page = node.view
+		
+		response = page.render_to_response(self.get_request(node))
+		self.assertEqual(response.status_code, 200)
+		etag = response['ETag']
+		self.assertEqual(etag, quote_etag(page.get_etag(self.get_request(node))))
+		
+		response = page.render_to_response(self.get_request(node, HTTP_IF_NONE_MATCH=etag))
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response.content, '')
+		
+		# Changing the page's content changes its ETag.
+		Contentlet.objects.create(page=page, name='changed', content='')
+		response = page.render_to_response(self.get_request(node, HTTP_IF_NONE_MATCH=etag))
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+	
+	def test_file_last_modified(self):
+		from calendar import timegm
+		from django.core.files.base import ContentFile
+		from django.utils.http import http_date
+		from philo.models import File
+		f = File(name='conditional', mimetype='text/plain')
+		f.file.save('conditional.txt', ContentFile('Conditional'), save=True)
+		try:
+			node = Node(slug='conditional', view=f)
+			last_modified = http_date(timegm(f.get_last_modified(None).utctimetuple()))
+			
+			response = f.render_to_response(self.get_request(node))
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(response['Last-Modified'], last_modified)
+			
+			response = f.render_to_response(self.get_request(node, HTTP_IF_MODIFIED_SINCE=last_modified))
+			self.assertEqual(response.status_code, 304)
+			
+			response = f.render_to_response(self.get_request(node, HTTP_IF_MODIFIED_SINCE=http_date(0)))
+			self.assertEqual(response.status_code, 200)
+		finally:
+			f.file.delete(save=False)
+
+
+class TemplateCacheTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def test_compiled_template_cache(self):
+		from philo.models import pages
+		pages.USE_TEMPLATE_CACHE = True
+		try:
+			template = Template.objects.all()[0]
+			compiled = template.get_compiled()
+			self.assertTrue(Template.objects.get(pk=template.pk).get_compiled() is compiled)
+			
+			template.code += ' '
+			self.assertFalse(template.get_compiled() is compiled)
+			
+			compiled = template.get_compiled()
+			Template.objects.exclude(pk=template.pk)[0].save()
+			self.assertFalse(template.get_compiled() is compiled)
+		finally:
+			pages.USE_TEMPLATE_CACHE = False
+	
+	def test_compiled_template_parents(self):
+		from philo.models import pages
+		old_loaders, settings.TEMPLATE_LOADERS = settings.TEMPLATE_LOADERS, ('philo.loaders.database.Loader',)
+		loader.template_source_loaders = None
+		pages.USE_TEMPLATE_CACHE = True
+		try:
+			Template.objects.create(name='Base', slug='base', code='{% block content %}Base{% endblock %}')
+			Template.objects.create(name='Middle', slug='middle', code='{% extends "base" %}{% block content %}Middle {{ block.super }}{% endblock %}')
+			child = Template.objects.create(name='Child', slug='child', code='{% extends "middle" %}{% block content %}Child {{ block.super }}{% endblock %}')
+		
+			compiled = child.get_compiled()
+			parent = compiled.nodelist[0].get_parent(template.Context())
+			settings.DEBUG = True
+			try:
+				queries = len(connection.queries)
+				self.assertEqual(compiled.render(template.Context()), 'Child Middle Base')
+				self.assertEqual(child.get_compiled().render(template.Context()), 'Child Middle Base')
+				self.assertEqual(len(connection.queries), queries)
+			finally:
+				settings.DEBUG = False
+			# The parents are parsed once, along with the cached template.
+			self.assertTrue(child.get_compiled().nodelist[0].get_parent(template.Context()) is parent)
+		
+			base = Template.objects.get(slug='base')
+			base.code = '{% block content %}Changed{% endblock %}'
+			base.save()
+			self.assertEqual(child.get_compiled().render(template.Context()), 'Child Middle Changed')
+		finally:
+			pages.USE_TEMPLATE_CACHE = False
+			settings.TEMPLATE_LOADERS = old_loaders
+			loader.template_source_loaders = None
+	
+	def test_cached_database_loader(self):
+		from philo.loaders.database import CachedLoader
+		template_loader = CachedLoader()
+		
+		compiled, origin = template_loader.load_template('entry')
+		self.assertEqual(compiled.render(template.Context()), 'Entry detail page.')
+		self.assertTrue(template_loader.load_template('/entry/')[0] is compiled)
+		self.assertRaises(template.TemplateDoesNotExist, template_loader.load_template, 'missing')
+		
+		entry = Template.objects.get(slug='entry')
+		entry.code = 'Changed.'
+		entry.save()
+		compiled = template_loader.load_template('entry')[0]
+		self.assertEqual(compiled.render(template.Context()), 'Changed.')
+		
+		Template.objects.get(slug='tag').save()
+		self.assertFalse(template_loader.load_template('entry')[0] is compiled)
+		
+		# A template which was loaded while another thread reset the loader for
+		# a newer version isn't stored in the newer cache.
+		class RacingLoader(CachedLoader):
+			def _get_path_index(self, version):
+				path_index = super(RacingLoader, self)._get_path_index(version)
+				self.reset('newer')
+				return path_index
+		
+		template_loader = RacingLoader()
+		self.assertEqual(template_loader.load_template('entry')[0].render(template.Context()), 'Changed.')
+		self.assertEqual(template_loader._templates, {})
+		self.assertEqual(template_loader._path_index, None)
+
+
+class ByteRangeTestCase(TestCase):
+	def test_parse_byte_ranges(self):
+		self.assertEqual(parse_byte_ranges(None, 1000), None)
+		self.assertEqual(parse_byte_ranges('bytes=0-499', 1000), [(0, 499)])
+		self.assertEqual(parse_byte_ranges('bytes=500-', 1000), [(500, 999)])
+		self.assertEqual(parse_byte_ranges('bytes=-200', 1000), [(800, 999)])
+		self.assertEqual(parse_byte_ranges('bytes=0-0, 900-1500', 1000), [(0, 0), (900, 999)])
+		self.assertEqual(parse_byte_ranges('bytes=1000-', 1000), [])
+		self.assertEqual(parse_byte_ranges('bytes=5-2', 1000), None)
+		self.assertEqual(parse_byte_ranges('bytes=a-b', 1000), None)
+		self.assertEqual(parse_byte_ranges('items=0-1', 1000), None)
+
 
 class TreePathTestCase(TestCase):
 	urls = 'philo.urls'
@@ -188,6 +854,73 @@ class TreePathTestCase(TestCase):
 		# Speed increase for leaf nodes - should this be tested?
 		self.assertQueryLimit(1, (fifth, 'sub/path/tail/len/five'), 'root/second/third/fourth/fifth/sub/path/tail/len/five', absolute_result=False)
 	
+	def test_full_path(self):
+		root = Node.objects.get(slug='root')
+		second = Node.objects.get(slug='second')
+		fifth = Node.objects.get(slug='fifth')
+		
+		# The fixture doesn't contain full paths; they are computed when it is loaded.
+		self.assertEqual(fifth.full_path, 'root/second/third/fourth/fifth')
+		self.assertEqual(Template.objects.get(slug='entry').full_path, 'entry')
+		
+		# Non-absolute lookups take a single query, however deep the result.
+		self.assertQueryLimit(1, (fifth, 'sub/path/tail'), 'root/second/third/fourth/fifth/sub/path/tail', absolute_result=False)
+		self.assertQueryLimit(1, (root, 'secont/third'), 'secont/third', root=root, absolute_result=False)
+		
+		# Renaming a node updates the full paths of its descendants.
+		second.slug = 'renamed'
+		second.save()
+		fifth = Node.objects.get(pk=fifth.pk)
+		self.assertEqual(fifth.full_path, 'root/renamed/third/fourth/fifth')
+		self.assertQueryLimit(1, fifth, 'root/renamed/third/fourth/fifth')
+		self.assertQueryLimit(1, Node.DoesNotExist, 'root/second/third/fourth/fifth')
+		self.assertQueryLimit(0, 'renamed/third/fourth/fifth', root, callable=fifth.get_path)
+	
+	def test_get_with_routing_table(self):
+		root = Node.objects.get(slug='root')
+		third = Node.objects.get(slug='third')
+		second2 = Node.objects.get(slug='second2')
+		e = Node.DoesNotExist
+		call = Node.objects.get_with_routing_table
+		
+		# Building the table takes one query; lookups after that take none.
+		self.assertQueryLimit(1, (second2, 'sub/path/tail'), 'root/second2/sub/path/tail', callable=call)
+		self.assertQueryLimit(0, (third, None), 'root/second/third/', callable=call)
+		self.assertQueryLimit(0, (root, None), '', root=root, callable=call)
+		self.assertQueryLimit(0, (third, None), 'second/third', root=root, callable=call)
+		self.assertQueryLimit(0, (root, 'secont/third'), 'secont/third', root=root, callable=call)
+		self.assertQueryLimit(0, e, 'invalid/path', callable=call)
+		
+		# Changes to the tree cause the table to be rebuilt.
+		second2.slug = 'renamed'
+		second2.save()
+		self.assertQueryLimit(1, (second2, 'sub'), 'root/renamed/sub', callable=call)
+		self.assertQueryLimit(0, (root, 'second2/sub'), 'second2/sub', root=root, callable=call)
+		
+		# So do changes to the Node model's version, which the shared
+		# attribute caches are checked against as well.
+		bump_cache_version(make_model_version_key(ContentType.objects.get_for_model(Node).pk))
+		self.assertQueryLimit(1, (third, None), 'root/second/third', callable=call)
+	
+	def test_get_cached_path(self):
+		root = Node.objects.get(slug='root')
+		third = Node.objects.get(slug='third')
+		second2 = Node.objects.get(slug='second2')
+		call = Node.objects.get_cached_path
+		
+		self.assertQueryLimit(1, 'root/second/third', third.pk, callable=call)
+		self.assertQueryLimit(0, 'second/third', third.pk, root.pk, callable=call)
+		self.assertQueryLimit(0, '', root.pk, root.pk, callable=call)
+		self.assertQueryLimit(0, AncestorDoesNotExist, second2.pk, third.pk, callable=call)
+		self.assertQueryLimit(0, KeyError, 0, callable=call)
+		
+		# Paths come from the routing table, so the two share one build and one
+		# set of version markers.
+		self.assertQueryLimit(0, (third, None), 'root/second/third', callable=Node.objects.get_with_routing_table)
+		bump_cache_version(make_model_version_key(ContentType.objects.get_for_model(Node).pk))
+		self.assertQueryLimit(1, 'second/third', third.pk, root.pk, callable=call)
+		self.assertQueryLimit(0, (third, None), 'root/second/third', callable=Node.objects.get_with_routing_table)
+	
 	def test_get_path(self):
 		root = Node.objects.get(slug='root')
 		root2 = Node.objects.get(slug='root')
@@ -216,3 +949,125 @@ class ContainerTestCase(TestCase):
 		contentlet_specs, contentreference_specs = t.containers
 		self.assertEqual(len(contentlet_specs), 0)
 		self.assertEqual(contentreference_specs, SortedDict([('one', ct), ('two', ct)]))
+	
+	def test_stored_containers(self):
+		old_loaders, settings.TEMPLATE_LOADERS = settings.TEMPLATE_LOADERS, ('philo.loaders.database.Loader',)
+		loader.template_source_loaders = None
+		try:
+			t = Template.objects.create(name='One', slug='one', code="{% container one %}")
+			self.assertEqual(Template.objects.get(pk=t.pk).container_spec[2], ['one'])
+			
+			# A current stored analysis is read without any queries if the code
+			# doesn't load other templates, and with one query otherwise.
+			child = Template.objects.create(name='Child', slug='child', code='{% extends "one" %}')
+			self.assertEqual(Template.objects.get(pk=child.pk).container_spec[2], ['one'])
+			t = Template.objects.get(pk=t.pk)
+			child = Template.objects.get(pk=child.pk)
+			settings.DEBUG = True
+			try:
+				queries = len(connection.queries)
+				self.assertEqual(t.containers[0], ['one'])
+				self.assertEqual(len(connection.queries), queries)
+				self.assertEqual(child.containers[0], ['one'])
+				self.assertEqual(len(connection.queries), queries + 1)
+			finally:
+				settings.DEBUG = False
+			
+			# Saving a template updates the stored analyses of the templates
+			# which extend it.
+			t.code = "{% container two %}"
+			t.save()
+			self.assertEqual(Template.objects.get(pk=child.pk).container_spec[2], ['two'])
+			
+			# Changes which bypass save() are noticed when the analysis is read,
+			# but the stale analysis isn't written from there.
+			Template.objects.filter(pk=t.pk).update(code="{% container three %}")
+			child = Template.objects.get(pk=child.pk)
+			spec = child.container_spec
+			self.assertEqual(child.containers[0], ['three'])
+			self.assertEqual(Template.objects.get(pk=child.pk).container_spec, spec)
+			
+			# Moving the extended template breaks the child's extends.
+			other = Template.objects.create(name='Other', slug='other', code="")
+			self.assertEqual(Template.objects.get(pk=child.pk).container_spec[2], ['three'])
+			Template.objects.get(pk=t.pk).move_to(other)
+			self.assertEqual(Template.objects.get(pk=child.pk).container_spec, None)
+			
+			# The analysis of unsaved code isn't stored.
+			t = Template.objects.get(pk=t.pk)
+			t.code = "{% container four %}"
+			self.assertEqual(t.containers[0], ['four'])
+			self.assertEqual(Template.objects.get(pk=t.pk).container_spec[2], ['three'])
+			t.save()
+			self.assertEqual(Template.objects.get(pk=t.pk).container_spec[2], ['four'])
+		finally:
+			settings.TEMPLATE_LOADERS = old_loaders
+			loader.template_source_loaders = None
+	
+	def test_prefetched_container_content(self):
+		t = Template.objects.create(name='Containers', slug='containers', code="{% container one %}|{% container two %}|{% container tag references philo.tag as tag %}{{ tag.name }}")
+		page = Page.objects.create(template=t, title='Containers')
+		Contentlet.objects.create(page=page, name='one', content='One')
+		tag = Tag.objects.all()[0]
+		ContentReference.objects.create(page=page, name='tag', content=tag)
+		
+		settings.DEBUG = True
+		try:
+			queries = len(connection.queries)
+			string = page.render_to_string()
+			# Contentlets, content references, and the referenced tags.
+			self.assertEqual(len(connection.queries), queries + 3)
+		finally:
+			settings.DEBUG = False
+		self.assertEqual(string, u'One|%s|%s' % (settings.TEMPLATE_STRING_IF_INVALID, tag.name))
+		self.assertFalse(hasattr(page, '_container_content'))
+		
+		# Nothing is loaded for templates without containers.
+		t = Template.objects.create(name='Plain', slug='plain', code="Plain")
+		page = Page.objects.create(template=t, title='Plain')
+		settings.DEBUG = True
+		try:
+			queries = len(connection.queries)
+			self.assertEqual(page.render_to_string(), u'Plain')
+			self.assertEqual(len(connection.queries), queries)
+		finally:
+			settings.DEBUG = False
+	
+	def test_template_string_cache(self):
+		from philo.utils.templates import TemplateStringCache
+		templates = TemplateStringCache(2)
+		one = templates.get_template('{{ one }}')
+		self.assertTrue(templates.get_template('{{ one }}') is one)
+		templates.get_template('{{ two }}')
+		templates.get_template('{{ one }}')
+		# The least recently used template ('{{ two }}') is evicted.
+		templates.get_template('{{ three }}')
+		self.assertTrue(templates.get_template('{{ one }}') is one)
+		self.assertEqual(templates.get_stats(), {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 3, 'evictions': 1})
+	
+	def test_cached_container(self):
+		page = Page.objects.create(template=Template.objects.create(name='Cached', slug='cached', code=''), title='Cached')
+		contentlet = Contentlet.objects.create(page=page, name='one', content='{{ flavor }} {{ count }}')
+		t = template.Template('{% container one cache 600 flavor %}')
+		
+		self.assertEqual(t.render(template.Context({'page': page, 'flavor': 'plain', 'count': 1})), 'plain 1')
+		# Variables which aren't listed after the timeout don't affect the cache key.
+		self.assertEqual(t.render(template.Context({'page': page, 'flavor': 'plain', 'count': 2})), 'plain 1')
+		self.assertEqual(t.render(template.Context({'page': page, 'flavor': 'spicy', 'count': 2})), 'spicy 2')
+		
+		# Saving the contentlet discards the cached fragments.
+		contentlet.content = '{{ flavor }}!'
+		contentlet.save()
+		self.assertEqual(t.render(template.Context({'page': page, 'flavor': 'plain', 'count': 3})), 'plain!')
+		
+		self.assertRaises(template.TemplateSyntaxError, template.Template, '{% container one cache %}')
+		self.assertRaises(template.TemplateSyntaxError, template.Template, '{% container tag references philo.tag as tag cache 600 %}')
+		t = template.Template('{% container one cache timeout %}')
+		self.assertRaises(template.TemplateSyntaxError, t.render, template.Context({'page': page, 'timeout': 'soon'}))
+		
+		# Names which aren't valid in memcached keys are hashed.
+		Contentlet.objects.create(page=page, name='two words', content='Spaced')
+		node = template.Template('{% container "two words" cache 600 %}').nodelist[0]
+		context = template.Context({'page': page})
+		self.assertEqual(node.render(context), 'Spaced')
+		self.assertFalse(' ' in node.get_cache_key(page.contentlets.get(name='two words'), context))
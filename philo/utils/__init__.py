@@ -1,3 +1,6 @@
+import uuid
+
+from django.core.cache import cache
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.core.paginator import Paginator, EmptyPage
@@ -143,6 +146,69 @@ def paginate(objects, per_page=None, page_number=1):
 	return paginator, page, objects
 
 
+### Cache versioning
+
+
+#: The prefix for cache keys used by :func:`get_cache_version` and :func:`bump_cache_version`.
+VERSION_CACHE_PREFIX = 'philo_version'
+#: How long version markers will be kept in the cache (in seconds). Default: 30 days.
+VERSION_CACHE_TIMEOUT = 60*60*24*30
+
+
+def _make_version_key(key):
+	return '%s:%s' % (VERSION_CACHE_PREFIX, key)
+
+
+def get_cache_version(key):
+	"""
+	Returns an opaque version marker for ``key``. The marker is stored using django's cache framework and will change whenever :func:`bump_cache_version` is called with the same ``key``, which makes it suitable for validating process-level caches across every process that shares a cache backend. If the marker has been evicted, a new one is generated, so a stale marker is never reused.
+	
+	"""
+	cache_key = _make_version_key(key)
+	version = cache.get(cache_key)
+	if version is None:
+		version = uuid.uuid4().hex
+		if not cache.add(cache_key, version, VERSION_CACHE_TIMEOUT):
+			version = cache.get(cache_key, version)
+	return version
+
+
+def bump_cache_version(key):
+	"""Replaces the version marker for ``key`` with a new one and returns it."""
+	version = uuid.uuid4().hex
+	cache.set(_make_version_key(key), version, VERSION_CACHE_TIMEOUT)
+	return version
+
+
+def get_cache_versions(keys):
+	"""Returns a dictionary mapping each of the given ``keys`` to its current version marker, as :func:`get_cache_version` would, while fetching existing markers in a single cache operation."""
+	cache_keys = dict([(_make_version_key(key), key) for key in keys])
+	found = cache.get_many(cache_keys.keys())
+	versions = {}
+	for cache_key, key in cache_keys.items():
+		if cache_key in found:
+			versions[key] = found[cache_key]
+		else:
+			versions[key] = get_cache_version(key)
+	return versions
+
+
+def check_cache_versions(versions):
+	"""Returns ``True`` if every marker in ``versions`` - a dictionary as returned by :func:`get_cache_versions` - is still current, and ``False`` otherwise. Evicted markers are never current."""
+	cache_keys = dict([(_make_version_key(key), version) for key, version in versions.items()])
+	return cache.get_many(cache_keys.keys()) == cache_keys
+
+
+def make_object_version_key(content_type_id, pk):
+	"""Returns the version key for the instance with the given content type id and ``pk``. The marker is replaced whenever the instance or, for :class:`.Entity` subclasses, its :class:`.Attribute`\ s change."""
+	return 'object:%s:%s' % (content_type_id, pk)
+
+
+def make_model_version_key(content_type_id):
+	"""Returns the version key for the model with the given content type id. The marker is replaced whenever any instance of the model changes."""
+	return 'model:%s' % content_type_id
+
+
 ### Facilitating template analysis.
 
 
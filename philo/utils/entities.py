@@ -1,12 +1,111 @@
 from UserDict import DictMixin
+from copy import copy
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 
+from philo.utils import get_cache_version, get_cache_versions, check_cache_versions, make_object_version_key
+
+
+#: Whether resolved :class:`TreeAttributeMapper` caches should be shared across requests and processes through django's cache framework. This is controlled by the ``PHILO_TREE_ATTRIBUTE_CACHE`` setting. Default: ``False``.
+USE_TREE_ATTRIBUTE_CACHE = getattr(settings, 'PHILO_TREE_ATTRIBUTE_CACHE', False)
+#: How long shared :class:`TreeAttributeMapper` caches will be kept (in seconds). This is controlled by the ``PHILO_TREE_ATTRIBUTE_CACHE_TIMEOUT`` setting. Default: 1 hour.
+TREE_ATTRIBUTE_CACHE_TIMEOUT = getattr(settings, 'PHILO_TREE_ATTRIBUTE_CACHE_TIMEOUT', 60*60)
+#: The prefix for cache keys used by the shared :class:`TreeAttributeMapper` cache.
+TREE_ATTRIBUTE_CACHE_PREFIX = 'philo_tree_attributes'
+#: Whether :class:`~philo.models.base.Entity` instances should use a :class:`CachedAttributeMapper` by default. This is controlled by the ``PHILO_ATTRIBUTE_CACHE`` setting. Default: ``False``.
+USE_ATTRIBUTE_CACHE = getattr(settings, 'PHILO_ATTRIBUTE_CACHE', False)
+#: How long :class:`CachedAttributeMapper` caches will be kept (in seconds). This is controlled by the ``PHILO_ATTRIBUTE_CACHE_TIMEOUT`` setting. Default: 1 hour.
+ATTRIBUTE_CACHE_TIMEOUT = getattr(settings, 'PHILO_ATTRIBUTE_CACHE_TIMEOUT', 60*60)
+#: The prefix for cache keys used by :class:`CachedAttributeMapper`.
+ATTRIBUTE_CACHE_PREFIX = 'philo_attributes'
+
 
 ### AttributeMappers
 
 
+def _load_values(attributes):
+	# Fetches the values of the given attributes with one query per value
+	# model, attaches them to the attributes, and returns a dictionary mapping
+	# attribute pks to the values' python values.
+	value_lookups = {}
+	for a in attributes:
+		if a.value_content_type_id is not None:
+			value_lookups.setdefault(a.value_content_type_id, []).append(a.value_object_id)
+	
+	values_bulk = {}
+	for ct_id, pks in value_lookups.items():
+		values_bulk[ct_id] = ContentType.objects.get_for_id(ct_id).model_class()._default_manager.in_bulk(pks)
+	
+	python_values = {}
+	for a in attributes:
+		value = values_bulk.get(a.value_content_type_id, {}).get(a.value_object_id)
+		# Spare a query if the attribute's value is accessed later.
+		setattr(a, a.__class__.value.cache_attr, value)
+		python_values[a.pk] = a.get_python_value()
+	return python_values
+
+
+def _get_value_class(value):
+	# Returns the AttributeValue subclass which is used to store ``value``.
+	from philo.models.base import JSONValue, ForeignKeyValue, ManyToManyValue
+	if isinstance(value, models.query.QuerySet):
+		return ManyToManyValue
+	elif isinstance(value, models.Model):
+		return ForeignKeyValue
+	return JSONValue
+
+
+def _pack_attributes(attributes):
+	# Returns a picklable representation of the given attributes (with their
+	# values attached) for storage with django's cache framework. The related
+	# ids of ManyToManyValues are stored as well, since their values are
+	# querysets. The instances ForeignKeyValues point to are left out, since
+	# changes to them aren't tracked; _unpack_attributes fetches them again.
+	from philo.models.base import Attribute, ForeignKeyValue, ManyToManyValue
+	packed = []
+	for attribute in attributes:
+		value = attribute.value
+		if isinstance(value, ManyToManyValue):
+			packed.append((attribute, list(value.object_ids)))
+		else:
+			if isinstance(value, ForeignKeyValue):
+				value = copy(value)
+				value.__dict__.pop(ForeignKeyValue.value.cache_attr, None)
+				attribute = copy(attribute)
+				setattr(attribute, Attribute.value.cache_attr, value)
+			packed.append((attribute, None))
+	return packed
+
+
+def _unpack_attributes(mapper, packed):
+	# Fills the caches of ``mapper`` from the result of _pack_attributes, with
+	# one query per model referenced by ForeignKeyValues.
+	from philo.models.base import Attribute, ForeignKeyValue
+	target_lookups = {}
+	for attribute, object_ids in packed:
+		value = getattr(attribute, Attribute.value.cache_attr, None)
+		if isinstance(value, ForeignKeyValue) and value.content_type_id is not None and value.object_id is not None:
+			target_lookups.setdefault(value.content_type_id, set()).add(value.object_id)
+	
+	targets = {}
+	for ct_id, pks in target_lookups.items():
+		targets[ct_id] = ContentType.objects.get_for_id(ct_id).model_class()._base_manager.in_bulk(list(pks))
+	
+	for attribute, object_ids in packed:
+		value = getattr(attribute, Attribute.value.cache_attr, None)
+		if object_ids is not None:
+			mapper._cache[attribute.key] = value.get_value_for_object_ids(object_ids)
+		else:
+			if isinstance(value, ForeignKeyValue) and value.content_type_id in targets:
+				setattr(value, ForeignKeyValue.value.cache_attr, targets[value.content_type_id].get(value.object_id))
+			mapper._cache[attribute.key] = attribute.get_python_value()
+		mapper._attributes_cache[attribute.key] = attribute
+	mapper._cache_filled = True
+
+
 class AttributeMapper(object, DictMixin):
 	"""
 	Given an :class:`~philo.models.base.Entity` subclass instance, this class allows dictionary-style access to the :class:`~philo.models.base.Entity`'s :class:`~philo.models.base.Attribute`\ s. In order to prevent unnecessary queries, the :class:`AttributeMapper` will cache all :class:`~philo.models.base.Attribute`\ s and the associated python values when it is first accessed.
@@ -27,26 +126,47 @@ class AttributeMapper(object, DictMixin):
 	def __setitem__(self, key, value):
 		"""Given a python value, sets the value of the :class:`~philo.models.base.Attribute` with the given ``key`` to that value."""
 		# Prevent circular import.
-		from philo.models.base import JSONValue, ForeignKeyValue, ManyToManyValue, Attribute
+		from philo.models.base import Attribute
 		old_attr = self.get_attribute(key)
-		if old_attr and old_attr.entity_content_type == ContentType.objects.get_for_model(self.entity) and old_attr.entity_object_id == self.entity.pk:
+		if old_attr and old_attr.entity_content_type_id == ContentType.objects.get_for_model(self.entity).pk and old_attr.entity_object_id == self.entity.pk:
 			attribute = old_attr
 		else:
 			attribute = Attribute(key=key)
 			attribute.entity = self.entity
 			attribute.full_clean()
 		
-		if isinstance(value, models.query.QuerySet):
-			value_class = ManyToManyValue
-		elif isinstance(value, models.Model):
-			value_class = ForeignKeyValue
-		else:
-			value_class = JSONValue
-		
-		attribute.set_value(value=value, value_class=value_class)
-		self._cache[key] = attribute.value.value
+		attribute.set_value(value=value, value_class=_get_value_class(value))
+		self._cache[key] = attribute.get_python_value()
 		self._attributes_cache[key] = attribute
 	
+	def set_many(self, mapping):
+		"""
+		Given a dictionary mapping keys to python values, sets the values of the :class:`~philo.models.base.Attribute`\ s with those keys as :meth:`__setitem__` would, but in bulk with :func:`~philo.models.base.set_attribute_values`. The keys are validated up front, without queries, and the cache is updated in place.
+		
+		"""
+		from philo.models.base import Attribute, ManyToManyValue, set_attribute_values
+		key_field = Attribute._meta.get_field('key')
+		values = []
+		for key, value in mapping.items():
+			key_field.clean(key, None)
+			values.append((key, value, _get_value_class(value)))
+		
+		attributes = set_attribute_values(self.entity, values)
+		for key, value, value_class in values:
+			attribute = attributes[key]
+			self._attributes_cache[key] = attribute
+			if value_class is ManyToManyValue:
+				# Spare a query for the relations which were just written.
+				self._cache[key] = value
+			else:
+				self._cache[key] = attribute.get_python_value()
+	
+	def update(self, *args, **kwargs):
+		"""Sets the values of many :class:`~philo.models.base.Attribute`\ s at once, from a dictionary or iterable of ``(key, value)`` pairs and/or keyword arguments. See :meth:`set_many`."""
+		mapping = {}
+		mapping.update(*args, **kwargs)
+		self.set_many(mapping)
+	
 	def get_attributes(self):
 		"""Returns an iterable of all of the :class:`~philo.models.base.Entity`'s :class:`~philo.models.base.Attribute`\ s."""
 		return self.entity.attribute_set.all()
@@ -79,19 +199,12 @@ class AttributeMapper(object, DictMixin):
 		if self._cache_filled:
 			return
 		
-		attributes = self.get_attributes()
-		value_lookups = {}
+		attributes = list(self.get_attributes())
+		python_values = _load_values(attributes)
 		
 		for a in attributes:
-			value_lookups.setdefault(a.value_content_type, []).append(a.value_object_id)
 			self._attributes_cache[a.key] = a
-		
-		values_bulk = {}
-		
-		for ct, pks in value_lookups.items():
-			values_bulk[ct] = ct.model_class().objects.in_bulk(pks)
-		
-		self._cache.update(dict([(a.key, getattr(values_bulk[a.value_content_type].get(a.value_object_id), 'value', None)) for a in attributes]))
+			self._cache[a.key] = python_values[a.pk]
 		self._cache_filled = True
 	
 	def clear_cache(self):
@@ -102,30 +215,64 @@ class AttributeMapper(object, DictMixin):
 
 
 class LazyAttributeMapperMixin(object):
-	"""In some cases, it may be that only one attribute value needs to be fetched. In this case, it is more efficient to avoid populating the cache whenever possible. This mixin overrides the :meth:`__getitem__` and :meth:`get_attribute` methods to prevent their populating the cache. If the cache has been populated (i.e. through :meth:`keys`, :meth:`values`, etc.), then the value or attribute will simply be returned from the cache."""
+	"""
+	In some cases, it may be that only one attribute value needs to be fetched. In this case, it is more efficient to avoid populating the cache whenever possible. This mixin overrides the :meth:`__getitem__` and :meth:`get_attribute` methods to prevent their populating the cache. If the cache has been populated (i.e. through :meth:`keys`, :meth:`values`, etc.), then the value or attribute will simply be returned from the cache.
+	
+	Each key which isn't cached is looked up on its own when it is first accessed. Keys which are known in advance can be loaded together with :meth:`preload` instead, with a single query for all of them. Keys which turn out to have no :class:`~philo.models.base.Attribute` are remembered, so they will not be looked up again until the cache is cleared.
+	
+	"""
 	def __getitem__(self, key):
 		if key not in self._cache and not self._cache_filled:
+			if key in self._missing_keys:
+				raise KeyError(key)
 			self._add_to_cache(key)
 		return self._cache[key]
 	
 	def get_attribute(self, key, default=None):
-		if key not in self._attributes_cache and not self._cache_filled:
-			self._add_to_cache(key)
+		if key not in self._attributes_cache and not self._cache_filled and key not in self._missing_keys:
+			try:
+				self._add_to_cache(key)
+			except KeyError:
+				pass
 		return self._attributes_cache.get(key, default)
 	
+	def preload(self, keys):
+		"""Loads the :class:`~philo.models.base.Attribute`\ s for any of the given ``keys`` which have not been loaded yet with a single query for the attributes, plus one per value model."""
+		if self._cache_filled:
+			return
+		pending = [key for key in keys if key not in self._cache and key not in self._missing_keys]
+		if not pending:
+			return
+		attributes = self._raw_get_attributes(pending)
+		python_values = _load_values(attributes.values())
+		for key in pending:
+			if key in attributes:
+				self._attributes_cache[key] = attributes[key]
+				self._cache[key] = python_values[attributes[key].pk]
+			else:
+				self._missing_keys.add(key)
+	
 	def _raw_get_attribute(self, key):
 		return self.get_attributes().get(key=key)
 	
+	def _raw_get_attributes(self, keys):
+		return dict([(a.key, a) for a in self.get_attributes().filter(key__in=keys)])
+	
 	def _add_to_cache(self, key):
 		from philo.models.base import Attribute
 		try:
 			attr = self._raw_get_attribute(key)
 		except Attribute.DoesNotExist:
-			raise KeyError
+			self._missing_keys.add(key)
+			raise KeyError(key)
 		else:
-			val = getattr(attr.value, 'value', None)
+			val = attr.get_python_value()
 			self._cache[key] = val
 			self._attributes_cache[key] = attr
+	
+	def clear_cache(self):
+		super(LazyAttributeMapperMixin, self).clear_cache()
+		self._missing_keys = set()
 
 
 class LazyAttributeMapper(LazyAttributeMapperMixin, AttributeMapper):
@@ -133,28 +280,117 @@ class LazyAttributeMapper(LazyAttributeMapperMixin, AttributeMapper):
 		return super(LazyAttributeMapper, self).get_attributes().exclude(key__in=self._cache.keys())
 
 
+class CachedAttributeMapper(AttributeMapper):
+	"""
+	An :class:`AttributeMapper` which stores its filled cache with django's cache framework, so that it is shared by every request and process using the same cache backend. Entries are keyed by the entity's content type, pk, and current version marker (see :func:`~philo.utils.make_object_version_key`). That marker is replaced whenever the entity, one of its :class:`~philo.models.base.Attribute`\ s, or one of their values is saved or deleted, so stale entries are never read; they simply expire after :data:`ATTRIBUTE_CACHE_TIMEOUT`.
+	
+	"""
+	def _fill_cache(self):
+		if self._cache_filled:
+			return
+		
+		if self.entity.pk is None:
+			super(CachedAttributeMapper, self)._fill_cache()
+			return
+		
+		ct = ContentType.objects.get_for_model(self.entity)
+		# The version is fetched before the data it guards, so that a change
+		# made in the meantime can't be hidden by the stored result.
+		version = get_cache_version(make_object_version_key(ct.pk, self.entity.pk))
+		cache_key = '%s:%s:%s:%s' % (ATTRIBUTE_CACHE_PREFIX, ct.pk, self.entity.pk, version)
+		cached = cache.get(cache_key)
+		if cached is not None:
+			_unpack_attributes(self, cached)
+			return
+		
+		super(CachedAttributeMapper, self)._fill_cache()
+		cache.set(cache_key, _pack_attributes(self._attributes_cache.values()), ATTRIBUTE_CACHE_TIMEOUT)
+
+
 class TreeAttributeMapper(AttributeMapper):
-	"""The :class:`~philo.models.base.TreeEntity` class allows the inheritance of :class:`~philo.models.base.Attribute`\ s down the tree. This mapper will return the most recently declared :class:`~philo.models.base.Attribute` among the :class:`~philo.models.base.TreeEntity`'s ancestors or set an attribute on the :class:`~philo.models.base.Entity` it is attached to."""
+	"""
+	The :class:`~philo.models.base.TreeEntity` class allows the inheritance of :class:`~philo.models.base.Attribute`\ s down the tree. This mapper will return the most recently declared :class:`~philo.models.base.Attribute` among the :class:`~philo.models.base.TreeEntity`'s ancestors or set an attribute on the :class:`~philo.models.base.Entity` it is attached to.
+	
+	If :data:`USE_TREE_ATTRIBUTE_CACHE` is ``True``, the resolved attributes will be stored with django's cache framework per content type and pk, and reused by any mapper for the same entity until an :class:`~philo.models.base.Attribute` of the entity or one of its ancestors changes or the tree is changed.
+	
+	"""
+	def get_ancestor_levels(self):
+		"""Returns a dictionary mapping the pks of the entity's ancestors (including the entity itself) to their levels. The result is cached until :meth:`clear_cache` is called."""
+		if self._ancestor_levels is None:
+			self._ancestor_levels = dict(self.entity.get_ancestors(include_self=True).values_list('pk', 'level'))
+		return self._ancestor_levels
+	
 	def get_attributes(self):
 		"""Returns a list of :class:`~philo.models.base.Attribute`\ s sorted by increasing parent level. When used to populate the cache, this will cause :class:`~philo.models.base.Attribute`\ s on the root to be overwritten by those on its children, etc."""
 		from philo.models import Attribute
-		ancestors = dict(self.entity.get_ancestors(include_self=True).values_list('pk', 'level'))
+		ancestors = self.get_ancestor_levels()
 		ct = ContentType.objects.get_for_model(self.entity)
 		attrs = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestors.keys())
 		return sorted(attrs, key=lambda x: ancestors[x.entity_object_id])
+	
+	def _uses_shared_cache(self):
+		return USE_TREE_ATTRIBUTE_CACHE and self.entity.pk is not None
+	
+	def _fill_cache(self):
+		if self._cache_filled:
+			return
+		
+		if not self._uses_shared_cache():
+			super(TreeAttributeMapper, self)._fill_cache()
+			return
+		
+		from philo.models.base import make_tree_version_key
+		ct = ContentType.objects.get_for_model(self.entity)
+		cache_key = '%s:%s:%s' % (TREE_ATTRIBUTE_CACHE_PREFIX, ct.pk, self.entity.pk)
+		cached = cache.get(cache_key)
+		if cached is not None and check_cache_versions(cached[0]):
+			_unpack_attributes(self, cached[1])
+			return
+		
+		# Versions are fetched before the data they guard, so that a change
+		# made in the meantime can't be hidden by the stored result.
+		versions = get_cache_versions([make_tree_version_key(self.entity.__class__)])
+		versions.update(get_cache_versions([make_object_version_key(ct.pk, pk) for pk in self.get_ancestor_levels()]))
+		super(TreeAttributeMapper, self)._fill_cache()
+		cache.set(cache_key, (versions, _pack_attributes(self._attributes_cache.values())), TREE_ATTRIBUTE_CACHE_TIMEOUT)
+	
+	def clear_cache(self):
+		super(TreeAttributeMapper, self).clear_cache()
+		self._ancestor_levels = None
+
+
+class ClosureAttributeMapper(TreeAttributeMapper):
+	"""A :class:`TreeAttributeMapper` which reads the :class:`~philo.models.base.Attribute`\ s an entity resolves to from the :class:`~philo.models.base.InheritedAttribute` rows maintained when :data:`~philo.models.base.USE_ATTRIBUTE_CLOSURE` is ``True``, so that no ancestor lookup is needed: the full effective attribute map is fetched with one indexed query, plus one per value model."""
+	def get_attributes(self):
+		from philo.models.base import Attribute
+		ct = ContentType.objects.get_for_model(self.entity)
+		return Attribute.objects.filter(inherited_by__entity_content_type=ct, inherited_by__entity_object_id=self.entity.pk)
 
 
 class LazyTreeAttributeMapper(LazyAttributeMapperMixin, TreeAttributeMapper):
+	"""A lazy :class:`TreeAttributeMapper`. The entity's ancestors are looked up once per mapper (see :meth:`~TreeAttributeMapper.get_ancestor_levels`), so each key which isn't cached costs a single query for its :class:`~philo.models.base.Attribute`\ s, plus one for the value. If :data:`USE_TREE_ATTRIBUTE_CACHE` is ``True``, the first lookup fills the whole cache from the shared cache instead, since the shared entry holds the resolved attributes as a whole."""
+	def _add_to_cache(self, key):
+		if self._uses_shared_cache():
+			self._fill_cache()
+		else:
+			super(LazyTreeAttributeMapper, self)._add_to_cache(key)
+	
+	def preload(self, keys):
+		if self._uses_shared_cache():
+			self._fill_cache()
+		else:
+			super(LazyTreeAttributeMapper, self).preload(keys)
+	
 	def get_attributes(self):
 		from philo.models import Attribute
-		ancestors = dict(self.entity.get_ancestors(include_self=True).values_list('pk', 'level'))
+		ancestors = self.get_ancestor_levels()
 		ct = ContentType.objects.get_for_model(self.entity)
 		attrs = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestors.keys()).exclude(key__in=self._cache.keys())
 		return sorted(attrs, key=lambda x: ancestors[x.entity_object_id])
 	
 	def _raw_get_attribute(self, key):
 		from philo.models import Attribute
-		ancestors = dict(self.entity.get_ancestors(include_self=True).values_list('pk', 'level'))
+		ancestors = self.get_ancestor_levels()
 		ct = ContentType.objects.get_for_model(self.entity)
 		try:
 			attrs = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestors.keys(), key=key)
@@ -162,6 +398,14 @@ class LazyTreeAttributeMapper(LazyAttributeMapperMixin, TreeAttributeMapper):
 			return sorted_attrs[0]
 		except IndexError:
 			raise Attribute.DoesNotExist
+	
+	def _raw_get_attributes(self, keys):
+		from philo.models import Attribute
+		ancestors = self.get_ancestor_levels()
+		ct = ContentType.objects.get_for_model(self.entity)
+		attrs = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestors.keys(), key__in=keys)
+		# Deeper attributes overwrite those of their ancestors.
+		return dict([(a.key, a) for a in sorted(attrs, key=lambda x: ancestors[x.entity_object_id])])
 
 
 class PassthroughAttributeMapper(AttributeMapper):
@@ -203,4 +447,18 @@ class LazyPassthroughAttributeMapper(LazyAttributeMapperMixin, PassthroughAttrib
 			attr = a.get_attribute(key)
 			if attr is not None:
 				return attr
-		raise Attribute.DoesNotExist
\ No newline at end of file
+		raise Attribute.DoesNotExist
+	
+	def _raw_get_attributes(self, keys):
+		attributes = {}
+		for a in self._attributes:
+			remaining = [key for key in keys if key not in attributes]
+			if not remaining:
+				break
+			if hasattr(a, 'preload'):
+				a.preload(remaining)
+			for key in remaining:
+				attr = a.get_attribute(key)
+				if attr is not None:
+					attributes[key] = attr
+		return attributes
\ No newline at end of file
@@ -0,0 +1,104 @@
+from hashlib import sha1
+import threading
+
+from django.conf import settings
+from django.template import Template
+from django.utils.encoding import smart_str
+
+
+#: The maximum number of compiled templates kept by :data:`template_string_cache`. This is controlled by the ``PHILO_TEMPLATE_STRING_CACHE_SIZE`` setting. Default: ``0``, which disables the cache. A size a little above the number of distinct contentlets and strings which are regularly rendered as templates - for example ``1000`` - is recommended.
+TEMPLATE_STRING_CACHE_SIZE = getattr(settings, 'PHILO_TEMPLATE_STRING_CACHE_SIZE', 0)
+
+
+_PREV, _NEXT, _KEY, _TEMPLATE = 0, 1, 2, 3
+
+
+class TemplateStringCache(object):
+	"""
+	A bounded, per-process cache of django templates compiled from strings, keyed by a hash of the string. When the cache is full, the least recently used template is evicted. Entries are kept in a doubly linked list ordered by use, so hits and evictions take constant time. Since the key is the template code itself, entries never need to be invalidated - with one caveat: anything which is loaded when a template is compiled, such as a template included by a constant ``{% include %}``, is kept as it was compiled, just as with django's cached template loader.
+	
+	:param max_size: The maximum number of compiled templates to keep. If this is less than 1, templates will be compiled on every call.
+	
+	"""
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self._lock = threading.Lock()
+		self.clear()
+	
+	def get_template(self, string, name=None):
+		"""Returns a compiled :class:`django.template.Template` for ``string``, compiling it if it isn't cached. ``name`` is only used if the template needs to be compiled. Syntax errors are raised as usual and never cached."""
+		if self.max_size < 1:
+			return Template(string, name=name)
+		
+		key = sha1(smart_str(string)).hexdigest()
+		self._lock.acquire()
+		try:
+			link = self._templates.get(key)
+			if link is not None:
+				self._unlink(link)
+				self._append(link)
+				self.hits += 1
+				return link[_TEMPLATE]
+			self.misses += 1
+		finally:
+			self._lock.release()
+		
+		# Compile outside the lock so that slow compilations don't block hits.
+		template = Template(string, name=name)
+		
+		self._lock.acquire()
+		try:
+			if key not in self._templates:
+				while len(self._templates) >= self.max_size:
+					oldest = self._root[_NEXT]
+					self._unlink(oldest)
+					del self._templates[oldest[_KEY]]
+					self.evictions += 1
+				link = [None, None, key, template]
+				self._append(link)
+				self._templates[key] = link
+		finally:
+			self._lock.release()
+		return template
+	
+	def _unlink(self, link):
+		link[_PREV][_NEXT] = link[_NEXT]
+		link[_NEXT][_PREV] = link[_PREV]
+	
+	def _append(self, link):
+		# Places ``link`` at the most recently used end of the list.
+		root = self._root
+		last = root[_PREV]
+		link[_PREV] = last
+		link[_NEXT] = root
+		last[_NEXT] = root[_PREV] = link
+	
+	def get_stats(self):
+		"""Returns a dictionary with the current ``size`` and ``max_size`` of the cache and its numbers of ``hits``, ``misses``, and ``evictions`` since it was created or last cleared."""
+		return {
+			'size': len(self._templates),
+			'max_size': self.max_size,
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+		}
+	
+	def clear(self):
+		"""Empties the cache and resets its statistics."""
+		self._lock.acquire()
+		try:
+			# The keys map to the links of a circular, doubly linked list of
+			# [prev, next, key, template] lists, which runs from the least to the
+			# most recently used template and starts and ends at _root.
+			self._templates = {}
+			self._root = root = []
+			root[:] = [root, root, None, None]
+			self.hits = 0
+			self.misses = 0
+			self.evictions = 0
+		finally:
+			self._lock.release()
+
+
+#: The :class:`TemplateStringCache` shared by the :ttag:`container` tag, for contentlets which contain template code, and the :ttag:`include_string` tag. Its size is set by :data:`TEMPLATE_STRING_CACHE_SIZE`.
+template_string_cache = TemplateStringCache(TEMPLATE_STRING_CACHE_SIZE)
@@ -1,11 +1,96 @@
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import resolve
 from django.http import Http404, HttpResponseRedirect
+from django.utils.cache import cc_delim_re, get_cache_key, learn_cache_key
+from django.utils.functional import wraps
 from django.views.decorators.vary import vary_on_headers
 
 from philo.exceptions import MIDDLEWARE_NOT_CONFIGURED
+from philo.utils import get_cache_versions, check_cache_versions
 
 
+#: Whether :func:`node_view` should use the response cache. This is controlled by the ``PHILO_RESPONSE_CACHE`` setting. Responses are only stored if :class:`~philo.middleware.ResponseCacheMiddleware` is installed. Default: ``False``.
+USE_RESPONSE_CACHE = getattr(settings, 'PHILO_RESPONSE_CACHE', False)
+#: How long responses will be kept in the response cache (in seconds). This is controlled by the ``PHILO_RESPONSE_CACHE_TIMEOUT`` setting. Default: 10 minutes.
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'PHILO_RESPONSE_CACHE_TIMEOUT', 600)
+#: The prefix for cache keys used by the response cache. The current site's id is appended.
+RESPONSE_CACHE_PREFIX = 'philo_response'
+
+
+def _get_response_cache_prefix():
+	return '%s.%s' % (RESPONSE_CACHE_PREFIX, settings.SITE_ID)
+
+
+def _request_is_cacheable(request):
+	if request.method != 'GET' or request.GET:
+		return False
+	# Requests with a session might see per-user content. Checking for the cookie
+	# instead of request.user avoids accessing the session, which would make
+	# every response vary on Cookie.
+	return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def _varies_on_cookie(response):
+	if not response.has_header('Vary'):
+		return False
+	return 'cookie' in [header.strip().lower() for header in cc_delim_re.split(response['Vary'])]
+
+
+def get_cached_response(request):
+	"""Returns the cached response for ``request`` or ``None`` if there is no current response cached. Cached responses are discarded as soon as any of the version markers they were tagged with changes."""
+	cache_key = get_cache_key(request, _get_response_cache_prefix(), cache=cache)
+	if cache_key is None:
+		return None
+	cached = cache.get(cache_key)
+	if cached is None:
+		return None
+	response, versions = cached
+	if not check_cache_versions(versions):
+		return None
+	return response
+
+
+def cache_response(request, response):
+	"""Stores ``response`` in the response cache if it is a successful response which was rendered by a :class:`.View` with :attr:`~.View.cache_responses` set and which doesn't depend on the individual visitor - that is, it sets no cookies, doesn't vary on Cookie, leaves the session unmodified, and neither used a CSRF token nor displayed or added messages. The entry is tagged with the results of the view's :meth:`~.View.get_response_cache_tags`; Vary headers are respected as by django's own cache middleware. Since cookies and Vary headers are added by other middleware, this is called by :class:`~philo.middleware.ResponseCacheMiddleware` after they have processed the response."""
+	if response.status_code != 200 or response.cookies or _varies_on_cookie(response):
+		return
+	if request.META.get('CSRF_COOKIE_USED'):
+		return
+	session = getattr(request, 'session', None)
+	if session is not None and session.modified:
+		return
+	messages = getattr(request, '_messages', None)
+	if messages is not None and (messages.used or messages.added_new):
+		return
+	cache_control = response.get('Cache-Control', '')
+	if 'private' in cache_control or 'no-cache' in cache_control or 'no-store' in cache_control:
+		return
+	node = getattr(request, 'node', None)
+	if not node or not node.view.cache_responses:
+		return
+	versions = get_cache_versions(node.view.get_response_cache_tags(request))
+	cache_key = learn_cache_key(request, response, RESPONSE_CACHE_TIMEOUT, _get_response_cache_prefix(), cache=cache)
+	cache.set(cache_key, (response, versions), RESPONSE_CACHE_TIMEOUT)
+
+
+def cache_node_response(view_func):
+	"""
+	If the ``PHILO_RESPONSE_CACHE`` setting is ``True``, responses to GET requests without a query string or a session cookie will be served from the response cache, which is keyed by site, path, and the headers listed in the response's Vary header. Cached responses are returned before any node lookup, so the :data:`~philo.signals.view_about_to_render` and :data:`~philo.signals.view_finished_rendering` signals are not sent for them. Other responses to such requests are marked to be stored by :class:`~philo.middleware.ResponseCacheMiddleware`.
+	
+	"""
+	def inner(request, *args, **kwargs):
+		if not USE_RESPONSE_CACHE or not _request_is_cacheable(request):
+			return view_func(request, *args, **kwargs)
+		response = get_cached_response(request)
+		if response is None:
+			response = view_func(request, *args, **kwargs)
+			request._cache_node_response = True
+		return response
+	return wraps(view_func)(inner)
+
+
+@cache_node_response
 @vary_on_headers('Accept')
 def node_view(request, path=None, **kwargs):
 	"""
@@ -16,7 +101,7 @@ def node_view(request, path=None, **kwargs):
 	
 	If these conditions are not met, then :func:`node_view` will either raise :exc:`Http404` or, if it seems like the address was mistyped (for example missing a trailing slash), return an :class:`HttpResponseRedirect` to the correct address.
 	
-	Otherwise, :func:`node_view` will call the :class:`.Node`'s :meth:`~.Node.render_to_response` method, passing ``kwargs`` in as the ``extra_context``.
+	Otherwise, :func:`node_view` will call the :class:`.Node`'s :meth:`~.Node.render_to_response` method, passing ``kwargs`` in as the ``extra_context``. Responses may be served from the response cache; see :func:`cache_node_response`.
 	
 	"""
 	if "philo.middleware.RequestNodeMiddleware" not in settings.MIDDLEWARE_CLASSES: